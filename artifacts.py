@@ -0,0 +1,198 @@
+import hashlib
+import json
+import os
+import sqlite3
+
+import numpy as np
+
+# --- 設定 ---
+CHUNK_DIR = "chunk"
+ARTIFACT_DIR = os.path.join("artifacts", "legal")
+
+# アーティファクトのファイル構成
+# - chunks.sqlite : チャンクのメタデータ（1行 = 1チャンク、row は vectors.npy の行番号と一致）
+# - vectors.npy   : (チャンク数, 次元数) の行列。np.load(mmap_mode="r") でメモリマップして読む
+# - meta.json     : ベクトルを作ったモデルID・入力テキストのハッシュ・次元数・dtype
+CHUNKS_DB = "chunks.sqlite"
+VECTORS_FILE = "vectors.npy"
+META_FILE = "meta.json"
+
+# 正規化済みベクトルのコサイン類似度なら float16 で十分（サイズは float32 の半分）
+DEFAULT_VECTOR_DTYPE = "float16"
+
+# 絞り込みや結合に使う列は SQLite の列として持ち、それ以外は payload 列に JSON で入れる
+INDEXED_COLUMNS = ["chunk_id", "parent_id", "law_name", "level", "article_id"]
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS chunks (
+    row INTEGER PRIMARY KEY,
+    {", ".join(f"{col} TEXT" for col in INDEXED_COLUMNS)},
+    combined_text TEXT,
+    payload TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_chunks_chunk_id ON chunks(chunk_id);
+CREATE INDEX IF NOT EXISTS idx_chunks_law_name ON chunks(law_name);
+"""
+
+
+def save_chunks(chunks, artifact_dir=ARTIFACT_DIR):
+    """
+    チャンクのリストを SQLite に書き出す（既存の chunks.sqlite は作り直す）。
+    "vector" キーを持つチャンク（embedding.py の旧出力）はベクトルを除いて保存する。
+    """
+    os.makedirs(artifact_dir, exist_ok=True)
+    db_path = os.path.join(artifact_dir, CHUNKS_DB)
+    if os.path.exists(db_path):
+        os.remove(db_path)
+
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.executescript(SCHEMA)
+        rows = []
+        for row, chunk in enumerate(chunks):
+            payload = {k: v for k, v in chunk.items() if k not in ("combined_text", "vector")}
+            rows.append((
+                row,
+                *[chunk.get(col) for col in INDEXED_COLUMNS],
+                chunk.get("combined_text"),
+                json.dumps(payload, ensure_ascii=False, separators=(",", ":")),
+            ))
+        placeholders = ", ".join("?" for _ in range(len(INDEXED_COLUMNS) + 3))
+        conn.executemany(f"INSERT INTO chunks VALUES ({placeholders})", rows)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def texts_fingerprint(texts):
+    """ベクトル化したテキスト列のハッシュ。チャンクが変わったのに古いベクトルを使い回さないための目印"""
+    digest = hashlib.sha1()
+    for text in texts:
+        digest.update(text.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def save_vectors(vectors, artifact_dir=ARTIFACT_DIR, model_id=None, fingerprint=None, dtype=DEFAULT_VECTOR_DTYPE):
+    """ベクトル行列を .npy（指定 dtype）で保存し、meta.json にモデル情報を残す"""
+    os.makedirs(artifact_dir, exist_ok=True)
+    vectors = np.ascontiguousarray(vectors, dtype=dtype)
+    np.save(os.path.join(artifact_dir, VECTORS_FILE), vectors)
+    with open(os.path.join(artifact_dir, META_FILE), "w", encoding="utf-8") as f:
+        json.dump({
+            "model_id": model_id,
+            "fingerprint": fingerprint,
+            "count": int(vectors.shape[0]),
+            "dim": int(vectors.shape[1]),
+            "dtype": str(vectors.dtype),
+        }, f, ensure_ascii=False, indent=2)
+
+
+def is_artifact_fresh(chunk_dir=CHUNK_DIR, artifact_dir=ARTIFACT_DIR):
+    """chunks.sqlite が存在し、chunk/*.json より新しければ True"""
+    db_path = os.path.join(artifact_dir, CHUNKS_DB)
+    if not os.path.exists(db_path):
+        return False
+    if not os.path.isdir(chunk_dir):
+        return True
+    db_mtime = os.path.getmtime(db_path)
+    return all(
+        os.path.getmtime(os.path.join(chunk_dir, f)) <= db_mtime
+        for f in os.listdir(chunk_dir) if f.endswith(".json")
+    )
+
+
+def load_chunks(artifact_dir=ARTIFACT_DIR, include_combined_text=True):
+    """chunks.sqlite を row 順に読み込み、チャンクの dict のリストを返す"""
+    conn = sqlite3.connect(os.path.join(artifact_dir, CHUNKS_DB))
+    try:
+        chunks = []
+        for combined_text, payload in conn.execute("SELECT combined_text, payload FROM chunks ORDER BY row"):
+            chunk = json.loads(payload)
+            if include_combined_text:
+                chunk["combined_text"] = combined_text
+            chunks.append(chunk)
+        return chunks
+    finally:
+        conn.close()
+
+
+def load_meta(artifact_dir=ARTIFACT_DIR):
+    path = os.path.join(artifact_dir, META_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def load_vectors(artifact_dir=ARTIFACT_DIR, model_id=None, fingerprint=None):
+    """
+    vectors.npy を読み取り専用でメモリマップして返す（コピーは発生しない）。
+    model_id / fingerprint が meta.json と一致しない場合や、ファイルが無い場合は None を返す。
+    """
+    meta = load_meta(artifact_dir)
+    path = os.path.join(artifact_dir, VECTORS_FILE)
+    if meta is None or not os.path.exists(path):
+        return None
+    if model_id is not None and meta.get("model_id") != model_id:
+        return None
+    if fingerprint is not None and meta.get("fingerprint") != fingerprint:
+        return None
+    return np.load(path, mmap_mode="r")
+
+
+def load_json_chunks(chunk_dir=CHUNK_DIR):
+    """chunk/ 配下の全 JSON（chunk.py の出力）を1つのリストにまとめて読み込む"""
+    json_files = sorted(f for f in os.listdir(chunk_dir) if f.endswith(".json"))
+    chunks = []
+    for filename in json_files:
+        path = os.path.join(chunk_dir, filename)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if isinstance(data, list):
+                chunks.extend(data)
+            else:
+                print(f"警告: {path} の形式がリストではありません。スキップします。")
+        except json.JSONDecodeError as e:
+            print(f"警告: {path} の JSON パースに失敗しました: {e}")
+    return chunks
+
+
+def convert_json_to_artifact(chunk_dir=CHUNK_DIR, artifact_dir=ARTIFACT_DIR, model_id=None):
+    """
+    既存の chunk/*.json をアーティファクト形式に変換する。
+    チャンクに "vector" が含まれていれば（embedding.py の旧出力）、vectors.npy も書き出す。
+    """
+    chunks = load_json_chunks(chunk_dir)
+    if not chunks:
+        print(f"'{chunk_dir}' に変換できるチャンクがありません。")
+        return
+
+    save_chunks(chunks, artifact_dir)
+    print(f"{len(chunks)} 件のチャンクを {os.path.join(artifact_dir, CHUNKS_DB)} に保存しました。")
+
+    if all("vector" in chunk for chunk in chunks):
+        vectors = np.asarray([chunk["vector"] for chunk in chunks], dtype=np.float32)
+        save_vectors(vectors, artifact_dir, model_id=model_id)
+        print(f"ベクトル {vectors.shape} を {os.path.join(artifact_dir, VECTORS_FILE)} に保存しました。")
+
+    json_size = sum(
+        os.path.getsize(os.path.join(chunk_dir, f)) for f in os.listdir(chunk_dir) if f.endswith(".json")
+    )
+    artifact_size = sum(
+        os.path.getsize(os.path.join(artifact_dir, f)) for f in os.listdir(artifact_dir)
+    )
+    print(f"サイズ: JSON {json_size / 1e6:.1f} MB → アーティファクト {artifact_size / 1e6:.1f} MB")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="chunk/*.json を SQLite + .npy のアーティファクトに変換する")
+    parser.add_argument("--chunk-dir", default=CHUNK_DIR)
+    parser.add_argument("--artifact-dir", default=ARTIFACT_DIR)
+    parser.add_argument("--model-id", default=None, help="JSON にベクトルが含まれる場合、そのモデルID")
+    args = parser.parse_args()
+
+    convert_json_to_artifact(args.chunk_dir, args.artifact_dir, args.model_id)
@@ -3,41 +3,87 @@ import time
 import json
 import streamlit as st
 from cerebras.cloud.sdk import Cerebras
+from config import CEREBRAS_BASE_URL
 from utils.tools import (
     search_via_perplexity, 
     read_web_page, 
     python_calculator,
     TOOLS_SCHEMA
 )
+from backend.llm_scheduler import PRIORITY_INTERACTIVE, get_scheduler
+from backend.model_router import (
+    AUTO_MODEL,
+    AUTO_MAX_RETRIES,
+    AUTO_REQUEST_TIMEOUT_SEC,
+    MAX_FAILOVER_ATTEMPTS,
+    classify_request,
+    record_failure,
+    record_success,
+    route_models,
+)
 
 @st.cache_resource
 def get_cerebras_client():
     api_key = os.getenv("CEREBRAS_API_KEY")
     if not api_key:
         raise RuntimeError("CEREBRAS_API_KEY が .env に設定されていません。")
-    return Cerebras(api_key=api_key)
+    # リトライ（接続エラー・タイムアウトを含む）は llm_scheduler が行列に並び直して行うので、SDK 側のリトライは切る
+    return Cerebras(api_key=api_key, base_url=CEREBRAS_BASE_URL or None, max_retries=0)
 
-def chat_with_cerebras(messages, model_id, is_idea_mode):
+def create_completion(client, model_id, timeout=None, priority=PRIORITY_INTERACTIVE, max_retries=None, **kwargs):
     """
-    Cerebrasとのチャットを実行する。
-    Idea Modeの場合はツール群の使用を許可し、必要に応じてループ処理を行う。
+    1回の completions 呼び出し。プロセス共有のスケジューラの行列に priority で並び、
+    レート制限・同時実行数の範囲で実行する（429 / 5xx / 接続エラーはスケジューラが max_retries 回までリトライする。None なら既定値）。
+    timeout を指定した呼び出しは、その締め切りを超えたら遅すぎるとみなしてタイムアウトをリトライしない。
+    TTFT と出力速度（レスポンスの time_info / usage）をモデルごとに記録し、
+    失敗した場合は失敗を記録してから例外をそのまま送出する。
+    """
+    if timeout is not None:
+        kwargs["timeout"] = timeout
+    timing = {}
+
+    def call():
+        # 行列で待った時間は TTFT に含めない
+        timing["start"] = time.time()
+        return client.chat.completions.create(model=model_id, **kwargs)
+
+    try:
+        response = get_scheduler().run(call, priority, max_retries, retry_timeouts=timeout is None)
+    except Exception:
+        record_failure(model_id)
+        raise
+    elapsed = time.time() - timing["start"]
+
+    time_info = getattr(response, "time_info", None)
+    usage = getattr(response, "usage", None)
+    completion_tokens = getattr(usage, "completion_tokens", None)
+    completion_time = getattr(time_info, "completion_time", None)
+    if time_info is not None and completion_time is not None:
+        ttft = (getattr(time_info, "queue_time", 0) or 0) + (getattr(time_info, "prompt_time", 0) or 0)
+    else:
+        # time_info が無い場合は、通信込みの所要時間で代用する
+        ttft, completion_time = None, elapsed
+    record_success(model_id, ttft, completion_tokens, completion_time)
+    return response
+
+
+def run_chat(client, messages, model_id, is_idea_mode, notify, timeout=None, priority=PRIORITY_INTERACTIVE,
+             max_retries=None):
+    """
+    1つのモデルでチャットを実行し、(final_content, tool_outputs) を返す。
+    1回目の呼び出しが失敗した場合は例外を送出する（auto モードのフェイルオーバー用）。
+    max_retries は1回目の呼び出しのリトライ回数（フェイルオーバーしない2回目は既定値）。
     """
-    client = get_cerebras_client()
     tools = TOOLS_SCHEMA if is_idea_mode else None
     
-    start_time = time.time()
-    
     # 1st Pass
-    try:
-        response = client.chat.completions.create(
-            model=model_id,
-            messages=messages,
-            tools=tools,
-            temperature=0.8 if is_idea_mode else 0.1,
-            max_completion_tokens=2048
-        )
-    except Exception as e:
-        return f"Error (Cerebras): {e}", [], 0
+    response = create_completion(
+        client, model_id, timeout, priority, max_retries,
+        messages=messages,
+        tools=tools,
+        temperature=0.8 if is_idea_mode else 0.1,
+        max_completion_tokens=2048
+    )
 
     msg = response.choices[0].message
     tool_outputs = []
@@ -55,19 +101,19 @@ def chat_with_cerebras(messages, model_id, is_idea_mode):
             try:
                 if fn_name == "search_via_perplexity":
                     query = args["query"]
-                    st.toast(f"🕵️‍♀️ Searching: {query}")
+                    notify(f"🕵️‍♀️ Searching: {query}")
                     result = search_via_perplexity(query)
                     tool_outputs.append({"type": "search", "query": query, "result": result})
 
                 elif fn_name == "read_web_page":
                     url = args["url"]
-                    st.toast(f"📖 Reading: {url}")
+                    notify(f"📖 Reading: {url}")
                     result = read_web_page(url)
                     tool_outputs.append({"type": "read", "url": url, "result": result[:200] + "..."}) # UI表示用は短く
 
                 elif fn_name == "python_calculator":
                     code = args["code"]
-                    st.toast("🧮 Calculating...")
+                    notify("🧮 Calculating...")
                     result = python_calculator(code)
                     tool_outputs.append({"type": "calc", "code": code, "result": result})
                 
@@ -85,9 +131,10 @@ def chat_with_cerebras(messages, model_id, is_idea_mode):
             })
         
         # 2nd Pass (with Tool Results)
+        # ツールは実行済みなので、ここで失敗してもフェイルオーバーはしない
         try:
-            final_response = client.chat.completions.create(
-                model=model_id,
+            final_response = create_completion(
+                client, model_id, timeout, priority,
                 messages=messages,
                 # tools=None, # 2回目はループ防止のためツール無効化（必要なら回数制限付きループにする）
                 temperature=0.8,
@@ -100,10 +147,57 @@ def chat_with_cerebras(messages, model_id, is_idea_mode):
     else:
         final_content = msg.content
 
+    return final_content, tool_outputs
+
+
+def chat_with_cerebras(messages, model_id, is_idea_mode, notify=st.toast, current_phase=None,
+                       priority=PRIORITY_INTERACTIVE):
+    """
+    Cerebrasとのチャットを実行する。
+    Idea Modeの場合はツール群の使用を許可し、必要に応じてループ処理を行う。
+    notify はツール実行の通知先。画面の無いバックグラウンド実行（先読み）では None を渡す。
+    model_id が AUTO_MODEL の場合は、入力の重さ（current_phase も参考にする）から必要な品質を判定し、
+    実測で最も速いモデルから順に試す（失敗・タイムアウトしたら次のモデルへ）。
+    priority は共有スケジューラでの優先度（または PriorityTicket）。先読みは PRIORITY_SPECULATIVE の
+    PriorityTicket を渡して対話のターンを先に通し、ユーザーが結果を待ち始めたら優先度を上げる。
+    """
+    client = get_cerebras_client()
+    notify = notify or (lambda _: None)
+    
+    start_time = time.time()
+
+    if model_id == AUTO_MODEL:
+        user_input = next((m["content"] for m in reversed(messages) if m.get("role") == "user"), "")
+        profile = classify_request(user_input, is_idea_mode, current_phase)
+        candidates = route_models(profile)[:MAX_FAILOVER_ATTEMPTS]
+        timeout = AUTO_REQUEST_TIMEOUT_SEC
+    else:
+        profile = None
+        candidates = [model_id]
+        timeout = None
+
+    errors = []
+    for i, candidate in enumerate(candidates):
+        # 次の候補があるうちは、スケジューラのリトライで同じモデルに粘らずフェイルオーバーする
+        max_retries = AUTO_MAX_RETRIES if i < len(candidates) - 1 else None
+        try:
+            # フェイルオーバー時にツール呼び出しの途中経過を持ち越さないよう、履歴はコピーして渡す
+            final_content, tool_outputs = run_chat(
+                client, list(messages), candidate, is_idea_mode, notify, timeout, priority, max_retries
+            )
+            break
+        except Exception as e:
+            errors.append(f"{candidate}: {e}" if profile else str(e))
+    else:
+        return f"Error (Cerebras): {' / '.join(errors)}", [], 0
+
     end_time = time.time()
     latency = end_time - start_time
     
     # メタ情報付与
-    final_content += f"\n\n*(Thought Time: {latency:.4f}s)*"
+    if profile:
+        final_content += f"\n\n*(Thought Time: {latency:.4f}s, Model: {candidate} / auto: {profile['reason']})*"
+    else:
+        final_content += f"\n\n*(Thought Time: {latency:.4f}s)*"
 
-    return final_content, tool_outputs, latency
\ No newline at end of file
+    return final_content, tool_outputs, latency
@@ -0,0 +1,44 @@
+import uuid
+
+from qdrant_client.http import models
+
+from backend.qdrant_store import namespaced_point_id
+from config import ANALYSIS_STEPS
+
+# フレームワーク資料のチャンク（"{ソースファイル}#{連番}"）から決定的にポイントIDを作るための名前空間
+IDEA_POINT_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL, "startup-dojo/idea")
+
+# どのフェーズにも属さない資料（全フェーズの検索対象になる）
+COMMON_STEP_ID = 0
+COMMON_STEP_NAME = "共通"
+
+# upsert 時に作る payload index（フェーズでの絞り込み用）
+PAYLOAD_INDEXES = {
+    "step_id": models.PayloadSchemaType.INTEGER,
+    "step_name": models.PayloadSchemaType.KEYWORD,
+}
+
+
+def point_id(chunk_id):
+    """chunk_id からQdrantのポイントID（UUID文字列）を作る"""
+    return namespaced_point_id(IDEA_POINT_NAMESPACE, chunk_id)
+
+
+def step_id_for_phase(current_phase):
+    """フェーズ名（ANALYSIS_STEPS の値）から step_id を引く。該当しなければ None"""
+    for step_id, step_name in ANALYSIS_STEPS.items():
+        if step_name == current_phase:
+            return step_id
+    return None
+
+
+def build_phase_filter(current_phase):
+    """
+    現在のフェーズの資料と共通資料だけに絞るフィルタ。フェーズ名が ANALYSIS_STEPS に無ければ None（全体検索）。
+    """
+    step_id = step_id_for_phase(current_phase)
+    if step_id is None:
+        return None
+    return models.Filter(must=[
+        models.FieldCondition(key="step_id", match=models.MatchAny(any=[step_id, COMMON_STEP_ID])),
+    ])
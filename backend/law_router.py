@@ -0,0 +1,87 @@
+import time
+import unicodedata
+
+from backend.legal_index import build_search_filter, collection_fields
+
+# 質問文に含まれるキーワードから、対象法令を推定するためのルール
+# 法令名そのもの（略称含む）は重み3、典型的な論点キーワードは重み1
+LAW_KEYWORDS = {
+    "会社法": {
+        3: ("会社法",),
+        1: ("株式", "株主", "取締役", "監査役", "定款", "設立", "合同会社", "株式会社", "新株", "増資",
+            "資本金", "ストックオプション", "新株予約権", "配当", "役員", "登記", "合併", "解散", "議決権"),
+    },
+    "労働基準法": {
+        3: ("労働基準法", "労基法", "労基"),
+        1: ("労働", "解雇", "クビ", "残業", "賃金", "給料", "給与", "有給", "休暇", "労働時間", "36協定", "三六協定",
+            "雇用", "従業員", "社員", "アルバイト", "パート", "休憩", "就業規則", "割増", "労働者", "インターン"),
+    },
+    "特定商取引に関する法律": {
+        3: ("特定商取引", "特商法"),
+        1: ("通信販売", "通販", "訪問販売", "クーリングオフ", "クーリング・オフ", "ecサイト", "ネットショップ",
+            "返品", "広告", "定期購入", "サブスク", "連鎖販売", "マルチ", "電話勧誘", "特定継続的役務",
+            "表記", "申込み", "解約"),
+    },
+}
+
+# 絞り込みに必要な最低スコア（これ未満は全体検索にフォールバック）。
+# 法令名が1つ出てくるか、論点キーワードが2つ以上出てくれば絞り込む（「広告」「社員」だけでは絞らない）
+MIN_ROUTE_SCORE = 2
+# 最高スコアに対してこの比率以上の法令は候補に残す（複数法令にまたがる質問向け）
+KEEP_RATIO = 0.5
+
+# 件数キャッシュの有効期間（秒）。再構築でエイリアスが切り替わっても、この時間で新しい件数になる
+COUNT_CACHE_TTL_SEC = 300
+
+_collection_size_cache = {}
+
+
+def route_law_query(query):
+    """
+    質問文から対象法令を推定する（キーワードルールのみで、埋め込みやLLMは使わない）。
+
+    Returns:
+        (law_names, scores): 絞り込む法令名のリスト（確信度が低い場合は None = 全体検索）と、法令ごとのスコア。
+    """
+    normalized = unicodedata.normalize("NFKC", query).lower()
+    scores = {}
+    for law_name, weighted in LAW_KEYWORDS.items():
+        score = 0
+        for weight, keywords in weighted.items():
+            score += weight * sum(1 for kw in keywords if kw in normalized)
+        scores[law_name] = score
+
+    top = max(scores.values())
+    if top < MIN_ROUTE_SCORE:
+        return None, scores
+
+    law_names = [name for name, score in scores.items() if score >= top * KEEP_RATIO and score > 0]
+    if len(law_names) == len(LAW_KEYWORDS):
+        # どの法令にも同程度マッチする場合は絞り込まない
+        return None, scores
+    return law_names, scores
+
+
+def count_search_space(qdrant_client, collection, law_names=None):
+    """検索対象になるポイント数を数える（法令ごとの件数は COUNT_CACHE_TTL_SEC の間キャッシュする）"""
+    key = (collection, tuple(sorted(law_names)) if law_names else None)
+    cached = _collection_size_cache.get(key)
+    if cached is None or time.time() - cached[1] > COUNT_CACHE_TTL_SEC:
+        count = qdrant_client.count(
+            collection_name=collection,
+            count_filter=build_search_filter(law_names, fields=collection_fields(qdrant_client, collection)),
+            exact=True,
+        ).count
+        cached = (count, time.time())
+        _collection_size_cache[key] = cached
+    return cached[0]
+
+
+def describe_search_space(qdrant_client, collection, law_names):
+    """絞り込みによって検索空間がどれだけ小さくなったかを1行で返す"""
+    total = count_search_space(qdrant_client, collection)
+    if not law_names:
+        return f"全法令を検索 ({total} chunks)"
+    scoped = count_search_space(qdrant_client, collection, law_names)
+    reduction = (1 - scoped / total) * 100 if total else 0.0
+    return f"{' / '.join(law_names)} に絞り込み ({total} → {scoped} chunks, -{reduction:.0f}%)"
@@ -0,0 +1,227 @@
+import datetime
+import uuid
+
+from qdrant_client.http import models
+
+from backend.qdrant_store import namespaced_point_id
+from config import VALID_TO_OPEN
+
+# chunk_id（"会社法|本則|第二条|第1項" など）から決定的にポイントIDを作るための名前空間
+LEGAL_POINT_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL, "startup-dojo/legal")
+
+# 子チャンクで検索するときに多めに取ってから親（条）単位にまとめる倍率
+CHILD_OVERFETCH = 4
+# これより長い条は全文ではなく、マッチした項・号だけをプロンプトに載せる
+PARENT_EXPAND_MAX_CHARS = 1200
+# 参照条文の展開でプロンプトに追加してよい量の目安
+REF_EXPAND_TOKEN_BUDGET = 1500
+
+# 取り込んだ最新版（valid_to が番兵値の版）だけに当たる基準日
+LATEST_AS_OF = VALID_TO_OPEN - 1
+
+# upsert 時に作る payload index（法令名・章での絞り込み用）
+PAYLOAD_INDEXES = {
+    "law_name": models.PayloadSchemaType.KEYWORD,
+    "chapter": models.PayloadSchemaType.KEYWORD,
+    "searchable": models.PayloadSchemaType.BOOL,
+    # 版（施行日）をまたいだ親・参照先の引き当てと、基準日での絞り込み用
+    "chunk_id": models.PayloadSchemaType.KEYWORD,
+    "valid_from": models.PayloadSchemaType.INTEGER,
+    "valid_to": models.PayloadSchemaType.INTEGER,
+}
+
+
+def point_id(chunk_id):
+    """chunk_id からQdrantのポイントID（UUID文字列）を作る。upsert側と検索側で同じ関数を使うこと。"""
+    return namespaced_point_id(LEGAL_POINT_NAMESPACE, chunk_id)
+
+
+def record_point_id(chunk):
+    """
+    有効期間付きチャンク1件のポイントID。同じ chunk_id でも改正前後で別のポイントになる。
+    改正されなかったチャンクは版をまたいで1件なので、ベクトルと payload も1つだけ保存される。
+    """
+    if chunk.get("valid_from"):
+        return point_id(f"{chunk['chunk_id']}@{chunk['valid_from']}")
+    return point_id(chunk["chunk_id"])
+
+
+def normalize_as_of(as_of):
+    """基準日（date / "YYYY-MM-DD" / "YYYYMMDD" / int）を YYYYMMDD の int にする。None はそのまま返す"""
+    if as_of is None or as_of == "":
+        return None
+    if isinstance(as_of, (datetime.date, datetime.datetime)):
+        return as_of.year * 10000 + as_of.month * 100 + as_of.day
+    if isinstance(as_of, int):
+        return as_of
+    return int(str(as_of).replace("-", "").replace("/", ""))
+
+
+def validity_conditions(as_of=None):
+    """
+    基準日に有効なチャンクだけを残す条件（valid_from <= as_of < valid_to）。
+    as_of が None の場合は今日施行されている版を対象にする（施行日が未来の版は含めない）。
+    """
+    as_of = normalize_as_of(as_of)
+    if as_of is None:
+        as_of = normalize_as_of(datetime.date.today())
+    return [
+        models.FieldCondition(key="valid_from", range=models.Range(lte=as_of)),
+        models.FieldCondition(key="valid_to", range=models.Range(gt=as_of)),
+    ]
+
+
+def collection_fields(qdrant_client, collection):
+    """コレクションの payload に含まれるフィールド名（先頭の1件から判定する）"""
+    records, _ = qdrant_client.scroll(
+        collection_name=collection, limit=1, with_payload=True, with_vectors=False
+    )
+    return set(records[0].payload or {}) if records else set()
+
+
+def build_search_filter(law_names=None, as_of=None, fields=None):
+    """
+    検索対象を「子チャンク＋子を持たない条」かつ基準日に有効な版に絞るフィルタ。
+    law_names を渡すと、その法令だけに絞り込む（law_name の payload index が効く）。
+    fields（collection_fields の結果）を渡すと、payload に無いフィールドの条件は付けない。
+    条単位・版なしの旧形式のコレクション（searchable / valid_to が無い）は、絞り込みなしで全件を検索する。
+    """
+    def has(field):
+        return fields is None or field in fields
+
+    must = []
+    if has("searchable"):
+        must.append(models.FieldCondition(key="searchable", match=models.MatchValue(value=True)))
+    if law_names and has("law_name"):
+        must.append(models.FieldCondition(key="law_name", match=models.MatchAny(any=list(law_names))))
+    if has("valid_to"):
+        must.extend(validity_conditions(as_of))
+    return models.Filter(must=must) if must else None
+
+
+def fetch_chunks(qdrant_client, collection, chunk_ids, as_of=None):
+    """
+    chunk_id のリストから、基準日に有効な版のポイントを引く（ベクトル検索ではなく payload フィルタ）。
+    戻り値は {chunk_id: Record}。
+    """
+    chunk_ids = list(dict.fromkeys(chunk_ids))
+    if not chunk_ids:
+        return {}
+    records, _ = qdrant_client.scroll(
+        collection_name=collection,
+        scroll_filter=models.Filter(must=[
+            models.FieldCondition(key="chunk_id", match=models.MatchAny(any=chunk_ids)),
+            *validity_conditions(as_of),
+        ]),
+        limit=len(chunk_ids),
+        with_payload=True,
+        with_vectors=False,
+    )
+    return {r.payload.get("chunk_id"): r for r in records}
+
+
+def expand_to_parents(qdrant_client, collection, hits, top_k, as_of=None):
+    """
+    項・号単位でマッチした検索結果を、親の条単位にまとめ直す。
+
+    - 同じ条にマッチした子チャンクは1件にまとめ、最も高いスコアを採用する。
+    - 条が短ければ条の全文、長ければマッチした項・号だけをテキストとして返す。
+    戻り値は main.py の表示と互換の ScoredPoint のリスト。
+    """
+    groups = {}
+    for hit in hits:
+        payload = hit.payload or {}
+        parent_key = payload.get("parent_id") or payload.get("chunk_id")
+        if parent_key is None:
+            # chunk_id を持たない旧形式のコレクションはそのまま返す
+            parent_key = str(hit.id)
+        if parent_key not in groups:
+            if len(groups) >= top_k:
+                continue
+            groups[parent_key] = {"score": hit.score, "hits": []}
+        groups[parent_key]["hits"].append(hit)
+
+    # 親の条をまとめて取得（ベクトル検索ではなく chunk_id と有効期間での引き当て）
+    parent_ids = [
+        key for key, group in groups.items()
+        if group["hits"][0].payload and group["hits"][0].payload.get("parent_id")
+    ]
+    parents = fetch_chunks(qdrant_client, collection, parent_ids, as_of)
+
+    results = []
+    for key, group in groups.items():
+        first = group["hits"][0]
+        parent = parents.get(key)
+        if parent is None:
+            # 子を持たない条にマッチした場合、または親が見つからない場合
+            results.append(first)
+            continue
+
+        payload = dict(parent.payload)
+        if len(payload.get("text", "")) > PARENT_EXPAND_MAX_CHARS:
+            matched_texts = []
+            for hit in group["hits"]:
+                text = hit.payload.get("text", "")
+                if text and text not in matched_texts:
+                    matched_texts.append(text)
+            payload["text"] = "（関連する項・号のみ抜粋）\n" + "\n".join(matched_texts)
+            payload["matched"] = [hit.payload.get("title") for hit in group["hits"]]
+            # 参照の展開も、抜粋した項・号からの参照だけに絞る（条全体の refs だと削った項の参照で予算を使い切る）
+            refs = []
+            for hit in group["hits"]:
+                for target in hit.payload.get("refs") or []:
+                    if target not in refs:
+                        refs.append(target)
+            payload["refs"] = refs
+
+        results.append(models.ScoredPoint(
+            id=parent.id, version=0, score=group["score"], payload=payload
+        ))
+    return results
+
+
+def estimate_tokens(text):
+    """日本語の条文はおおむね1文字≒1トークン以上になるので、文字数で保守的に見積もる"""
+    return len(text)
+
+
+def expand_references(qdrant_client, collection, results, token_budget, as_of=None):
+    """
+    検索結果の条が参照している条文（chunk.py で作った refs 隣接リスト）を1ホップだけ追加する。
+
+    - 複数の検索結果から参照されている条ほど優先し、同数なら上位の検索結果からの参照を優先する。
+    - 追加分のテキスト量が token_budget に収まる範囲で追加する。
+    参照先は chunk_id で直接引くため、参照ごとのベクトル検索は発生しない。
+    """
+    present = {(r.payload or {}).get("chunk_id") for r in results}
+    votes = {}
+    cited_by = {}
+    for rank, res in enumerate(results):
+        payload = res.payload or {}
+        for target in payload.get("refs") or []:
+            if target in present:
+                continue
+            count, best_rank = votes.get(target, (0, rank))
+            votes[target] = (count + 1, min(best_rank, rank))
+            cited_by.setdefault(target, payload.get("title") or payload.get("article_id"))
+
+    if not votes:
+        return []
+
+    candidates = sorted(votes, key=lambda t: (-votes[t][0], votes[t][1]))
+    by_chunk_id = fetch_chunks(qdrant_client, collection, candidates, as_of)
+
+    expanded = []
+    remaining = token_budget
+    for target in candidates:
+        record = by_chunk_id.get(target)
+        if record is None:
+            continue
+        cost = estimate_tokens(record.payload.get("text", ""))
+        if cost > remaining:
+            continue
+        remaining -= cost
+        payload = dict(record.payload)
+        payload["referenced_by"] = cited_by[target]
+        expanded.append(models.ScoredPoint(id=record.id, version=0, score=0.0, payload=payload))
+    return expanded
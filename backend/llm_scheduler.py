@@ -0,0 +1,229 @@
+import heapq
+import itertools
+import random
+import threading
+import time
+
+from config import CEREBRAS_BURST, CEREBRAS_MAX_CONCURRENCY, CEREBRAS_RATE_PER_SEC
+
+# 優先度（小さいほど先に実行する）
+PRIORITY_INTERACTIVE = 0   # ユーザーが待っているターン
+PRIORITY_SPECULATIVE = 1   # 先読みなど、使われないかもしれない処理
+
+# 429 / 5xx / 接続エラーのリトライ
+MAX_RETRIES = 4
+BACKOFF_BASE_SEC = 0.5
+BACKOFF_MAX_SEC = 8.0
+# 同時実行枠のうち、対話リクエスト用に空けておく数（先読みが枠を埋めてユーザーを待たせないため）
+RESERVED_INTERACTIVE_SLOTS = 1
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+# ステータスの無い失敗のうちリトライするもの。Cerebras / OpenAI の SDK は同じ名前の例外を持つので、
+# SDK を import せずにクラス名（基底クラスを含む）で判定する
+CONNECTION_ERROR_NAMES = {"APIConnectionError"}
+TIMEOUT_ERROR_NAMES = {"APITimeoutError"}
+
+
+def status_code_of(error):
+    """SDK の例外から HTTP ステータスを取り出す（無ければ None）"""
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status
+
+
+def _error_names(error):
+    return {cls.__name__ for cls in type(error).__mro__}
+
+
+def is_retryable(error, retry_timeouts=True):
+    """
+    リトライしてよい失敗か。408 / 409 / 429 / 5xx と、ステータスの無い接続エラー・タイムアウト。
+    retry_timeouts=False ならタイムアウトはリトライしない（呼び出し元が締め切りを決めている場合）。
+    """
+    names = _error_names(error)
+    if names & TIMEOUT_ERROR_NAMES:
+        return retry_timeouts
+    if names & CONNECTION_ERROR_NAMES:
+        return True
+    return status_code_of(error) in RETRYABLE_STATUS
+
+
+def retry_after_of(error):
+    """429 の Retry-After ヘッダ（秒）。無ければ None"""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt, retry_after=None):
+    """指数バックオフ + フルジッター。Retry-After があればそれより短くはしない"""
+    delay = random.uniform(0, min(BACKOFF_MAX_SEC, BACKOFF_BASE_SEC * (2 ** attempt)))
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
+
+
+class PriorityTicket:
+    """
+    run() に priority の代わりに渡せる、後から上げられる優先度。
+    先読みの LLM 呼び出しに使い、ユーザーがその結果を待ち始めたら RequestScheduler.promote で対話と同じ優先度にする。
+    """
+
+    def __init__(self, priority=PRIORITY_SPECULATIVE):
+        self.priority = priority
+        # 行列に並んでいる間の [優先度, 到着順]（heap の要素そのもの）
+        self.entry = None
+
+
+class RequestScheduler:
+    """
+    プロセス全体で共有する Cerebras 呼び出しのスケジューラ。
+
+    - トークンバケット（rate_per_sec 件/秒、最大 burst 件まで溜まる）でリクエストの発行ペースを抑える（0 なら無制限）
+    - 同時実行数を max_concurrency に制限する（先読みは RESERVED_INTERACTIVE_SLOTS 分の枠を使えない）
+    - 待ち行列は優先度順（対話 → 先読み）、同じ優先度なら到着順。並んでいる間に promote で優先度を上げられる
+    - 408 / 409 / 429 / 5xx と接続エラー・タイムアウトはジッター付き指数バックオフでリトライする（リトライも行列に並び直してトークンを使う）
+    """
+
+    def __init__(self, rate_per_sec=CEREBRAS_RATE_PER_SEC, burst=CEREBRAS_BURST,
+                 max_concurrency=CEREBRAS_MAX_CONCURRENCY, max_retries=MAX_RETRIES):
+        self.rate_per_sec = rate_per_sec
+        self.burst = max(1, burst)
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_retries = max_retries
+        self.tokens = float(self.burst)
+        self.last_refill = time.monotonic()
+        self.active = 0
+        self.queue = []
+        self.seq = itertools.count()
+        self.cond = threading.Condition()
+        self.metrics = {
+            "requests": 0, "attempts": 0, "retries": 0, "rate_limited": 0, "failed": 0,
+            "max_queue_depth": 0, "wait_total_sec": 0.0, "wait_max_sec": 0.0,
+        }
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.last_refill) * self.rate_per_sec)
+        self.last_refill = now
+
+    def _slot_limit(self, priority):
+        if priority > PRIORITY_INTERACTIVE and self.max_concurrency > RESERVED_INTERACTIVE_SLOTS:
+            return self.max_concurrency - RESERVED_INTERACTIVE_SLOTS
+        return self.max_concurrency
+
+    def _acquire(self, ticket):
+        """行列の先頭になり、同時実行枠とトークンが空くまで待つ。待った秒数を返す"""
+        start = time.monotonic()
+        with self.cond:
+            entry = [ticket.priority, next(self.seq)]
+            ticket.entry = entry
+            heapq.heappush(self.queue, entry)
+            self.metrics["max_queue_depth"] = max(self.metrics["max_queue_depth"], len(self.queue))
+            while True:
+                self._refill()
+                has_token = self.rate_per_sec <= 0 or self.tokens >= 1
+                # entry[0] は promote で書き換わることがある
+                if self.queue[0] is entry and self.active < self._slot_limit(entry[0]) and has_token:
+                    heapq.heappop(self.queue)
+                    ticket.entry = None
+                    self.tokens -= 1
+                    self.active += 1
+                    # 次の人が先頭になったので起こす
+                    self.cond.notify_all()
+                    break
+                # トークン待ちなら補充される頃に、枠待ち・順番待ちなら release で起こされる
+                timeout = None
+                if self.tokens < 1 and self.rate_per_sec > 0:
+                    timeout = (1 - self.tokens) / self.rate_per_sec
+                self.cond.wait(timeout)
+        waited = time.monotonic() - start
+        with self.cond:
+            self.metrics["wait_total_sec"] += waited
+            self.metrics["wait_max_sec"] = max(self.metrics["wait_max_sec"], waited)
+        return waited
+
+    def _release(self):
+        with self.cond:
+            self.active -= 1
+            self.cond.notify_all()
+
+    def promote(self, ticket, priority=PRIORITY_INTERACTIVE):
+        """ticket の優先度を上げる。行列に並んでいればその場で並び替える（以降のリトライもこの優先度で並ぶ）"""
+        with self.cond:
+            if priority >= ticket.priority:
+                return
+            ticket.priority = priority
+            if ticket.entry is not None:
+                ticket.entry[0] = priority
+                heapq.heapify(self.queue)
+                self.cond.notify_all()
+
+    def run(self, fn, priority=PRIORITY_INTERACTIVE, max_retries=None, retry_timeouts=True):
+        """
+        fn() を順番が来てから実行し、結果を返す。priority は優先度か PriorityTicket。
+        リトライしてよい例外（is_retryable）はバックオフしてリトライし、リトライし尽くしたら最後の例外を送出する。
+        max_retries を渡すとリトライ回数を上書きする（別のモデルにフェイルオーバーできる呼び出し元は少なくする）。
+        retry_timeouts=False ならタイムアウトはリトライせずにそのまま送出する。
+        """
+        if max_retries is None:
+            max_retries = self.max_retries
+        ticket = priority if isinstance(priority, PriorityTicket) else PriorityTicket(priority)
+        with self.cond:
+            self.metrics["requests"] += 1
+        attempt = 0
+        while True:
+            self._acquire(ticket)
+            try:
+                with self.cond:
+                    self.metrics["attempts"] += 1
+                return fn()
+            except Exception as e:
+                status = status_code_of(e)
+                with self.cond:
+                    if status == 429:
+                        self.metrics["rate_limited"] += 1
+                    retryable = is_retryable(e, retry_timeouts) and attempt < max_retries
+                    self.metrics["retries" if retryable else "failed"] += 1
+                if not retryable:
+                    raise
+                delay = backoff_delay(attempt, retry_after_of(e) if status == 429 else None)
+            finally:
+                self._release()
+            attempt += 1
+            time.sleep(delay)
+
+    def snapshot(self):
+        """現在の行列の長さ・実行中の数と、累計のメトリクス"""
+        with self.cond:
+            data = dict(self.metrics)
+            data["queue_depth"] = len(self.queue)
+            data["active"] = self.active
+        waits = data["attempts"]
+        data["wait_avg_sec"] = data["wait_total_sec"] / waits if waits else 0.0
+        return data
+
+    def describe(self):
+        """サイドバー表示用の1行サマリ"""
+        m = self.snapshot()
+        return (
+            f"待ち {m['queue_depth']} / 実行中 {m['active']}/{self.max_concurrency} / "
+            f"平均待ち {m['wait_avg_sec']:.2f}s (最大 {m['wait_max_sec']:.2f}s) / "
+            f"リトライ {m['retries']} (429: {m['rate_limited']}) / 失敗 {m['failed']}"
+        )
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """プロセスで1つの RequestScheduler を返す（全セッション・先読みスレッドで共有）"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = RequestScheduler()
+        return _scheduler
@@ -0,0 +1,135 @@
+import threading
+import time
+
+from config import CEREBRAS_MODEL_CHOICES
+
+# サイドバーで選べる「おまかせ」モード（リクエストごとに CEREBRAS_MODEL_CHOICES から選ぶ）
+AUTO_MODEL = "auto"
+
+# モデルごとの品質ティア（3 = 重い分析・法務、2 = 通常の回答、1 = 短い追い質問）と、
+# 実測が無いうちに使う速度の目安（TTFT 秒, 出力 tokens/s）
+MODEL_PROFILES = {
+    "llama-3.3-70b": {"tier": 2, "ttft": 0.3, "tps": 2000},
+    "gpt-oss-120b": {"tier": 3, "ttft": 0.3, "tps": 3000},
+    "qwen-3-32b": {"tier": 1, "ttft": 0.2, "tps": 2500},
+    "qwen-3-235b-a22b-instruct-2507": {"tier": 3, "ttft": 0.4, "tps": 1400},
+    "zai-glm-4.6": {"tier": 3, "ttft": 0.5, "tps": 1000},
+}
+
+# ティアごとに見込む出力トークン数（所要時間の見積もりに使う）
+EXPECTED_OUTPUT_TOKENS = {1: 300, 2: 800, 3: 1800}
+# 実測値の指数移動平均の重み（新しい観測をどれだけ効かせるか）
+EWMA_ALPHA = 0.3
+# 連続でこの回数失敗したモデルは COOLDOWN_SEC の間候補から外す
+FAILURES_BEFORE_COOLDOWN = 2
+COOLDOWN_SEC = 120
+# auto モードで1回の呼び出しを打ち切る秒数（遅いモデルは次の候補にフェイルオーバーする）
+AUTO_REQUEST_TIMEOUT_SEC = 30
+# auto モードで1リクエストあたり試すモデル数の上限
+MAX_FAILOVER_ATTEMPTS = 3
+# auto モードで、次の候補があるモデルへの 429 / 5xx / 接続エラーのリトライ回数（同じモデルで粘らず次のモデルへ移る）
+AUTO_MAX_RETRIES = 1
+
+# ツールを使いそうな質問（市場規模の調査・URL・計算）
+TOOL_HINTS = ("調べ", "検索", "市場規模", "最新", "ニュース", "競合", "http", "url", "計算", "試算", "何円", "何人", "%")
+# フレームワークで一通り分析させる入力（Next Move ボタンの文言を含む）
+DEEP_ANALYSIS_HINTS = ("次のメニュー", "叩き直して", "容赦なく", "詳細に分析", "まとめ", "分析して")
+SHORT_FOLLOW_UP_CHARS = 40
+LONG_INPUT_CHARS = 300
+
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def classify_request(user_input, is_idea_mode, current_phase=None):
+    """
+    入力から必要な品質ティアを決める（ルールのみで、LLM は使わない）。
+
+    Returns:
+        {"tier": 1〜3, "tools_likely": bool, "reason": str}
+    """
+    text = (user_input or "").lower()
+    tools_likely = is_idea_mode and any(hint in text for hint in TOOL_HINTS)
+
+    if not is_idea_mode:
+        return {"tier": 3, "tools_likely": False, "reason": "法務"}
+    if current_phase == "総合要点まとめ" or any(hint in text for hint in DEEP_ANALYSIS_HINTS):
+        return {"tier": 3, "tools_likely": tools_likely, "reason": "フレームワーク分析"}
+    if len(text) >= LONG_INPUT_CHARS:
+        return {"tier": 3, "tools_likely": tools_likely, "reason": "長い入力"}
+    if tools_likely:
+        return {"tier": 2, "tools_likely": True, "reason": "ツール利用"}
+    if len(text) <= SHORT_FOLLOW_UP_CHARS:
+        return {"tier": 1, "tools_likely": False, "reason": "短い追い質問"}
+    return {"tier": 2, "tools_likely": False, "reason": "通常"}
+
+
+def _model_stats(model_id):
+    if model_id not in _stats:
+        prior = MODEL_PROFILES.get(model_id, {"ttft": 1.0, "tps": 500})
+        _stats[model_id] = {
+            "ttft": prior["ttft"], "tps": prior["tps"], "calls": 0, "failures": 0,
+            "consecutive_failures": 0, "cooldown_until": 0.0,
+        }
+    return _stats[model_id]
+
+
+def record_success(model_id, ttft, completion_tokens, completion_time):
+    """1回の呼び出しの実測（TTFT と出力速度）を指数移動平均に反映する"""
+    with _stats_lock:
+        stats = _model_stats(model_id)
+        stats["calls"] += 1
+        stats["consecutive_failures"] = 0
+        if ttft is not None and ttft >= 0:
+            stats["ttft"] += EWMA_ALPHA * (ttft - stats["ttft"])
+        if completion_tokens and completion_time and completion_time > 0:
+            stats["tps"] += EWMA_ALPHA * (completion_tokens / completion_time - stats["tps"])
+
+
+def record_failure(model_id):
+    """失敗（例外・タイムアウト）を記録し、続いていれば一定時間候補から外す"""
+    with _stats_lock:
+        stats = _model_stats(model_id)
+        stats["calls"] += 1
+        stats["failures"] += 1
+        stats["consecutive_failures"] += 1
+        if stats["consecutive_failures"] >= FAILURES_BEFORE_COOLDOWN:
+            stats["cooldown_until"] = time.time() + COOLDOWN_SEC
+
+
+def expected_seconds(model_id, tier):
+    """実測（無ければ目安）から、このティアの回答にかかる秒数を見積もる"""
+    stats = _model_stats(model_id)
+    return stats["ttft"] + EXPECTED_OUTPUT_TOKENS[tier] / max(stats["tps"], 1.0)
+
+
+def route_models(profile, models=CEREBRAS_MODEL_CHOICES):
+    """
+    フェイルオーバー順の候補モデルを返す。
+    必要ティアを満たすモデルを見込み時間の短い順に並べ、その後ろにティアの低いモデル、最後に休止中のモデルを置く
+    （ティアを満たすモデルが全て休止中でも、低いティアのモデルで回答できる）。
+    """
+    tier = profile["tier"]
+    now = time.time()
+    with _stats_lock:
+        ranked = sorted(models, key=lambda m: expected_seconds(m, tier))
+        healthy = [m for m in ranked if _model_stats(m)["cooldown_until"] <= now]
+    qualified = [m for m in healthy if MODEL_PROFILES.get(m, {}).get("tier", 1) >= tier]
+    fallback = [m for m in healthy if m not in qualified]
+    cooling = [m for m in ranked if m not in healthy]
+    return qualified + fallback + cooling
+
+
+def describe_model_stats(models=CEREBRAS_MODEL_CHOICES):
+    """サイドバー表示用に、モデルごとの実測値を1行ずつ返す"""
+    lines = []
+    now = time.time()
+    with _stats_lock:
+        for model_id in models:
+            stats = _model_stats(model_id)
+            state = " (休止中)" if stats["cooldown_until"] > now else ""
+            lines.append(
+                f"{model_id}: TTFT {stats['ttft']:.2f}s / {stats['tps']:.0f} tok/s / "
+                f"失敗 {stats['failures']}/{stats['calls']}{state}"
+            )
+    return lines
@@ -0,0 +1,90 @@
+import re
+
+from qdrant_client.http import models
+
+# 1回の検索で投げるサブクエリの上限（元の質問を含む）
+MAX_SUB_QUERIES = 4
+
+# 口語・スタートアップ用語 → 条文に出てくる言い回し
+LEGAL_TERM_REWRITES = {
+    "クビ": "解雇",
+    "辞めさせ": "解雇",
+    "給料": "賃金",
+    "給与": "賃金",
+    "残業": "時間外労働 割増賃金",
+    "バイト": "アルバイト 労働者",
+    "有給": "年次有給休暇",
+    "サブスク": "定期購入 継続的役務提供",
+    "返金": "契約の解除 代金の返還",
+    "ネット販売": "通信販売",
+    "ネットショップ": "通信販売",
+    "社長": "代表取締役",
+    "起業": "会社の設立",
+    "会社を作": "会社の設立",
+    "株を渡": "株式の発行 割当て",
+    "出資": "出資 株式の引受け",
+}
+
+# 質問の言い回し（検索語としてはノイズになる部分）
+QUESTION_NOISE_RE = re.compile(
+    r"(について|って|とは)?(教えて(ください)?|知りたい|ですか|ますか|でしょうか|いいの|いい|どう(すれば|したら)?|[？?。！!、])"
+)
+# 前の発言を指している（単独では意味が取れない）質問の目印
+ANAPHORA_RE = re.compile(r"それ|その|この|あれ|さっき|同じ|上記|前の")
+# 短い追い質問は前の発言と組み合わせて検索する
+SHORT_QUERY_CHARS = 25
+
+
+def derive_sub_queries(user_query, history=None, current_phase=None, legal_terms=False):
+    """
+    1つの質問から、検索に使うサブクエリをルールベースで作る（LLMは使わない）。
+
+    - 元の質問
+    - 口語を条文の言い回しに置き換え、質問の言い回しを落としたキーワード版（legal_terms=True の Legal Mode のみ）
+    - 直前のユーザー発言と組み合わせた版（短い追い質問や「それ」「その」を含む場合）
+    - Idea Mode では現在のフェーズ名を付けた版
+    """
+    queries = [user_query]
+
+    keywords = user_query
+    # 条文用語への言い換えは法令検索専用（Idea Mode で「起業」を「会社の設立」にするとフレームワーク検索がずれる）
+    for colloquial, term in (LEGAL_TERM_REWRITES.items() if legal_terms else ()):
+        keywords = keywords.replace(colloquial, f" {term} ")
+    if keywords != user_query:
+        # 言い換えが効いた場合だけ追加する（句読点を落としただけのほぼ同じクエリは投げない）
+        keywords = " ".join(QUESTION_NOISE_RE.sub(" ", keywords).split())
+        if keywords:
+            queries.append(keywords)
+
+    previous = [h for h in (history or []) if h and h != user_query]
+    if previous and (len(user_query) <= SHORT_QUERY_CHARS or ANAPHORA_RE.search(user_query)):
+        queries.append(f"{previous[-1]} {user_query}")
+
+    if current_phase:
+        queries.append(f"{current_phase} {user_query}")
+
+    # 重複を除いて上限まで
+    unique = []
+    for q in queries:
+        if q not in unique:
+            unique.append(q)
+    return unique[:MAX_SUB_QUERIES]
+
+
+def batch_search(qdrant_client, collection, query_vectors, limit, query_filter=None):
+    """
+    複数のクエリベクトルを query_batch_points の1往復で検索し、ポイントIDで重複を除いてまとめる。
+    同じポイントが複数のサブクエリでヒットした場合は、最も高いスコアを採用する。
+    """
+    requests = [
+        models.QueryRequest(query=list(map(float, vec)), filter=query_filter, limit=limit, with_payload=True)
+        for vec in query_vectors
+    ]
+    responses = qdrant_client.query_batch_points(collection_name=collection, requests=requests)
+
+    best = {}
+    for resp in responses:
+        for point in resp.points:
+            if point.id not in best or point.score > best[point.id].score:
+                best[point.id] = point
+    return sorted(best.values(), key=lambda p: p.score, reverse=True)[:limit]
@@ -0,0 +1,170 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import streamlit as st
+
+from backend.llm_scheduler import PRIORITY_SPECULATIVE, PriorityTicket, get_scheduler
+
+# 先読みに使うスレッド数（プロセス全体で共有）。検索と LLM は別のプールにし、
+# 数十秒かかる LLM の先読みが他のセッションの検索の先読みを塞がないようにする
+PREFETCH_RETRIEVAL_WORKERS = 2
+PREFETCH_LLM_WORKERS = 2
+# 1セッションで先行実行してよい Cerebras 呼び出しの上限（使われなければ丸ごと無駄になるため）
+MAX_SPECULATIVE_LLM_CALLS = 10
+
+
+def next_step_prompt(next_step_name):
+    """「次へ」ボタンが送る入力文"""
+    return f"よし、次のメニュー「{next_step_name}」に進みたい。俺のアイデアをこのフレームワークで叩き直してくれ。"
+
+
+def deep_dive_prompt(current_step_name):
+    """「深掘り」ボタンが送る入力文"""
+    return f"今の「{current_step_name}」がまだ甘い気がする。もっと容赦なく、詳細に分析してくれ。"
+
+
+@st.cache_resource
+def get_prefetch_executors():
+    """(検索用, LLM 用) のスレッドプール"""
+    return (
+        ThreadPoolExecutor(max_workers=PREFETCH_RETRIEVAL_WORKERS, thread_name_prefix="prefetch-retrieval"),
+        ThreadPoolExecutor(max_workers=PREFETCH_LLM_WORKERS, thread_name_prefix="prefetch-llm"),
+    )
+
+
+class SpeculativePrefetcher:
+    """
+    Next Move ボタンの入力を、クリックされる前にバックグラウンドで処理しておく（セッションごとに1つ）。
+
+    ジョブは入力文・フェーズ・会話の長さ・設定から作ったキーで管理し、キーが一致したときだけ結果を使う。
+    検索（retrieval）と LLM 応答は別のジョブにしてあり、LLM が間に合わなくても検索結果だけは使える。
+    実行前のジョブはキャンセルでき、実行中の LLM 呼び出しは結果を捨てる。LLM の先行実行は1セッション max_llm_calls 回まで。
+    LLM 呼び出しは PRIORITY_SPECULATIVE で共有スケジューラに並び、クリックされたら対話と同じ優先度に上げる。
+    """
+
+    def __init__(self, retrieval_executor, llm_executor, max_llm_calls=MAX_SPECULATIVE_LLM_CALLS):
+        self.retrieval_executor = retrieval_executor
+        self.llm_executor = llm_executor
+        self.max_llm_calls = max_llm_calls
+        self.llm_calls = 0
+        # key -> {"retrieval": Future, "response": Future or None, "cancel": Event, "ticket": PriorityTicket}
+        self.jobs = {}
+        # 検索完了時のコールバック（ワーカースレッド）とクリック時の取り出しが競合しないようにする
+        self.lock = threading.Lock()
+        self.stats = {"scheduled": 0, "hits": 0, "partial_hits": 0, "misses": 0, "wasted": 0, "cancelled": 0}
+
+    def schedule(self, key, retrieve, respond=None):
+        """
+        retrieve() → (system_prompt, results) を先行実行する。
+        respond(system_prompt, priority) を渡した場合は、検索が終わり次第 LLM 応答も先行実行する（上限に達していなければ）。
+        priority は PriorityTicket なので、chat_with_cerebras にそのまま渡す。
+        同じキーのジョブが既にあれば何もしない（Streamlit の再実行ごとに呼ばれても1回だけ走る）。
+        """
+        if key in self.jobs:
+            return
+        job = {"retrieval": None, "response": None, "cancel": threading.Event(),
+               "ticket": PriorityTicket(PRIORITY_SPECULATIVE)}
+
+        def start_response(retrieval):
+            # 検索待ちでワーカーを塞がないよう、LLM ジョブは検索の完了後に投入する
+            if retrieval.cancelled() or retrieval.exception() is not None:
+                return
+            system_prompt, _ = retrieval.result()
+            with self.lock:
+                if job["cancel"].is_set() or self.llm_calls >= self.max_llm_calls:
+                    return
+                self.llm_calls += 1
+                job["response"] = self.llm_executor.submit(respond, system_prompt, job["ticket"])
+
+        job["retrieval"] = self.retrieval_executor.submit(retrieve)
+        if respond is not None:
+            job["retrieval"].add_done_callback(start_response)
+        self.jobs[key] = job
+        self.stats["scheduled"] += 1
+
+    def take(self, key):
+        """
+        クリックされた入力の先読み結果を取り出す。
+        Returns:
+            (system_prompt, results, response) または None（先読みが無い・失敗した・検索がまだ始まっていない場合）。
+            response は LLM まで先行できた場合のみ (response_text, tool_outputs, latency)、それ以外は None。
+        """
+        job = self.jobs.pop(key, None)
+        if job is None:
+            self.stats["misses"] += 1
+            return None
+
+        # 共有プールでまだ始まっていなければ、他のセッションの先読みの後ろで待たずにその場で検索させる
+        if job["retrieval"].cancel():
+            self._drop(job)
+            self.stats["misses"] += 1
+            return None
+
+        # 走っている検索は数百ミリ秒で終わるので待つ（最初からやり直すより必ず速い）
+        try:
+            system_prompt, results = job["retrieval"].result()
+        except Exception:
+            self._drop(job)
+            self.stats["misses"] += 1
+            return None
+
+        with self.lock:
+            job["cancel"].set()
+            pending = job["response"]
+        response = None
+        if pending is not None:
+            # LLM もプールでまだ始まっていなければキャンセルして検索結果だけ使い、実行中なら呼び直すより早いので待つ
+            if pending.cancel():
+                self.stats["cancelled"] += 1
+            else:
+                # ユーザーが待ち始めたので、スケジューラの行列で先読みの優先度のまま後回しにされないようにする
+                get_scheduler().promote(job["ticket"])
+                try:
+                    response = pending.result()
+                except Exception:
+                    response = None
+
+        self.stats["hits" if response is not None else "partial_hits"] += 1
+        return system_prompt, results, response
+
+    def retain(self, keys):
+        """keys 以外の先読みを破棄する（モード・設定・フェーズが変わって使われなくなったもの）"""
+        for key in [k for k in self.jobs if k not in keys]:
+            self._drop(self.jobs.pop(key))
+
+    def discard_all(self):
+        """残っている先読みを全て破棄する（別の入力が来た場合）"""
+        self.retain(())
+
+    def _drop(self, job):
+        with self.lock:
+            job["cancel"].set()
+            futures = (job["retrieval"], job["response"])
+        for future in futures:
+            if future is None:
+                continue
+            if future.cancel():
+                self.stats["cancelled"] += 1
+            else:
+                # 既に実行済み・実行中の処理は、結果が使われずに無駄になった
+                self.stats["wasted"] += 1
+
+    def summary(self):
+        """ヒット率・無駄打ち率の1行サマリ"""
+        s = self.stats
+        used = s["hits"] + s["partial_hits"]
+        lookups = used + s["misses"]
+        hit_rate = used / lookups * 100 if lookups else 0.0
+        work = used + s["wasted"]
+        waste_rate = s["wasted"] / work * 100 if work else 0.0
+        return (
+            f"先読みヒット {used}/{lookups} ({hit_rate:.0f}%, LLMまで {s['hits']}) / "
+            f"無駄打ち {s['wasted']} ({waste_rate:.0f}%) / LLM先行 {self.llm_calls}/{self.max_llm_calls}"
+        )
+
+
+def get_prefetcher():
+    """セッションの SpeculativePrefetcher を返す（無ければ作る）"""
+    if "prefetcher" not in st.session_state:
+        st.session_state.prefetcher = SpeculativePrefetcher(*get_prefetch_executors())
+    return st.session_state.prefetcher
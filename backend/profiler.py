@@ -0,0 +1,223 @@
+import contextlib
+import html
+import json
+import os
+import random
+import sys
+import threading
+import time
+import tracemalloc
+import zlib
+
+from config import PROFILE_DIR, PROFILE_SAMPLE_RATE
+
+# サンプリング間隔（秒）。5ms なら1秒の処理で約200サンプル
+SAMPLE_INTERVAL_SEC = 0.005
+# これより短い実行は保存しない（ウィジェット操作だけの再実行でディレクトリが埋まらないように）
+PROFILE_MIN_SEC = 0.5
+# メモリ差分として残す上位の行数
+MEMORY_TOP_N = 30
+# フレームグラフの描画設定
+FLAME_WIDTH = 1200
+FLAME_ROW_HEIGHT = 16
+FLAME_MIN_WIDTH = 0.5
+
+
+# tracemalloc はプロセスに1つしかないので、計測中の実行数を数え、最初の実行で開始して最後の実行で止める
+_tracing_lock = threading.Lock()
+_tracing_runs = 0
+_tracing_owned = False  # 自分で開始したか（PYTHONTRACEMALLOC などで外から有効にされていれば止めない）
+
+
+def acquire_tracing():
+    """tracemalloc を使い始める。自分を含めた計測中の実行数を返す"""
+    global _tracing_runs, _tracing_owned
+    with _tracing_lock:
+        if _tracing_runs == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _tracing_owned = True
+        _tracing_runs += 1
+        return _tracing_runs
+
+
+def release_tracing():
+    """acquire_tracing と対で呼ぶ。計測中の実行が無くなったら tracemalloc を止める"""
+    global _tracing_runs, _tracing_owned
+    with _tracing_lock:
+        _tracing_runs -= 1
+        if _tracing_runs == 0 and _tracing_owned:
+            tracemalloc.stop()
+            _tracing_owned = False
+
+
+def frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(";", ":")
+
+
+class SamplingProfiler:
+    """
+    別スレッドから対象スレッドのスタックを一定間隔で覗くサンプリングプロファイラ（標準ライブラリのみ）。
+    対象スレッドにはフックを入れないので、計測中も処理速度はほぼ変わらない。
+    """
+
+    def __init__(self, thread_id=None, interval=SAMPLE_INTERVAL_SEC):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval
+        self.counts = {}
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(frame_label(frame))
+                frame = frame.f_back
+            key = tuple(reversed(stack))
+            self.counts[key] = self.counts.get(key, 0) + 1
+            self.samples += 1
+
+    def collapsed(self):
+        """flamegraph.pl / speedscope で読める collapsed stacks（"root;child;leaf 件数"）"""
+        return "\n".join(f"{';'.join(stack)} {count}" for stack, count in sorted(self.counts.items()))
+
+
+def render_flamegraph(counts, title):
+    """collapsed stacks から、依存ライブラリ無しで見られる SVG のフレームグラフ（上から下へ伸びる icicle 形式）を作る"""
+    root = {"value": 0, "children": {}}
+    for stack, count in counts.items():
+        root["value"] += count
+        node = root
+        for name in stack:
+            node = node["children"].setdefault(name, {"value": 0, "children": {}})
+            node["value"] += count
+
+    total = root["value"] or 1
+    rects = []
+    max_depth = 0
+
+    def layout(node, x, depth):
+        nonlocal max_depth
+        for name, child in sorted(node["children"].items()):
+            width = child["value"] / total * FLAME_WIDTH
+            if width >= FLAME_MIN_WIDTH:
+                rects.append((name, child["value"], x, depth, width))
+                max_depth = max(max_depth, depth)
+                layout(child, x, depth + 1)
+            x += width
+
+    layout(root, 0.0, 0)
+    height = (max_depth + 1) * FLAME_ROW_HEIGHT + 30
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{FLAME_WIDTH}" height="{height}" '
+        f'font-family="monospace" font-size="11">',
+        f'<text x="4" y="16" font-size="13">{html.escape(title)} ({total} samples)</text>',
+    ]
+    for name, value, x, depth, width in rects:
+        y = 24 + depth * FLAME_ROW_HEIGHT
+        # 関数名から決まる暖色（同じ関数は同じ色）
+        hue = zlib.crc32(name.encode("utf-8")) % 60
+        label = html.escape(name)
+        parts.append(
+            f'<g><title>{label} — {value} samples ({value / total * 100:.1f}%)</title>'
+            f'<rect x="{x:.1f}" y="{y}" width="{width:.1f}" height="{FLAME_ROW_HEIGHT - 1}" '
+            f'fill="hsl({hue},85%,60%)"/>'
+        )
+        # 幅に収まる分だけ関数名を表示する（1文字 ≒ 7px）
+        chars = int(width // 7)
+        if chars >= 4:
+            text = name if len(name) <= chars else name[:chars - 2] + ".."
+            parts.append(f'<text x="{x + 2:.1f}" y="{y + 11}">{html.escape(text)}</text>')
+        parts.append("</g>")
+    parts.append("</svg>")
+    return "\n".join(parts)
+
+
+def memory_diff_lines(before, after, top_n=MEMORY_TOP_N):
+    """tracemalloc のスナップショット差分（増えた順）を1行ずつ返す"""
+    stats = after.compare_to(before, "lineno")
+    return [str(stat) for stat in stats[:top_n]]
+
+
+@contextlib.contextmanager
+def profile_request(label, out_dir=PROFILE_DIR, min_sec=PROFILE_MIN_SEC):
+    """
+    with ブロックの実行をサンプリングし、min_sec 以上かかった場合に out_dir/{日時}_{label}/ へ保存する。
+    - collapsed.txt : collapsed stacks
+    - flame.svg     : フレームグラフ
+    - memory.txt    : tracemalloc によるメモリ確保の差分（行単位の上位）
+    - summary.json  : 所要時間・サンプル数・メモリ増減
+    例外（Streamlit の st.rerun() を含む）で抜けた場合も、そこまでを保存する。
+    メモリの差分はプロセス全体のもので、同時に動いている他のセッションの確保も含む（summary.json の concurrent_runs）。
+    """
+    concurrent_runs = acquire_tracing()
+    try:
+        before = tracemalloc.take_snapshot()
+    except BaseException:
+        release_tracing()
+        raise
+    profiler = SamplingProfiler()
+    start = time.time()
+    profiler.start()
+    try:
+        yield
+    finally:
+        profiler.stop()
+        elapsed = time.time() - start
+        try:
+            after = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+        finally:
+            concurrent_runs = max(concurrent_runs, _tracing_runs)
+            release_tracing()
+
+        if elapsed >= min_sec and profiler.samples:
+            stamp = f"{time.strftime('%Y%m%d-%H%M%S', time.localtime(start))}.{int(start * 1000) % 1000:03d}"
+            run_dir = os.path.join(out_dir, f"{stamp}_{label}")
+            os.makedirs(run_dir, exist_ok=True)
+            with open(os.path.join(run_dir, "collapsed.txt"), "w", encoding="utf-8") as f:
+                f.write(profiler.collapsed() + "\n")
+            with open(os.path.join(run_dir, "flame.svg"), "w", encoding="utf-8") as f:
+                f.write(render_flamegraph(profiler.counts, f"{label} {elapsed:.2f}s"))
+            with open(os.path.join(run_dir, "memory.txt"), "w", encoding="utf-8") as f:
+                f.write(f"# プロセス全体の差分（同時に計測していた実行: {concurrent_runs}）\n")
+                f.write("\n".join(memory_diff_lines(before, after)) + "\n")
+            with open(os.path.join(run_dir, "summary.json"), "w", encoding="utf-8") as f:
+                json.dump({
+                    "label": label,
+                    "elapsed_sec": round(elapsed, 4),
+                    "samples": profiler.samples,
+                    "interval_sec": profiler.interval,
+                    # メモリの値は tracemalloc によるプロセス全体のもの（このリクエストだけの確保ではない）
+                    "memory_scope": "process",
+                    "concurrent_runs": concurrent_runs,
+                    "traced_memory_bytes": current,
+                    "traced_peak_bytes": peak,
+                    "allocated_delta_bytes": sum(s.size_diff for s in after.compare_to(before, "filename")),
+                }, f, ensure_ascii=False, indent=2)
+
+
+def should_profile(session_enabled=False, sample_rate=PROFILE_SAMPLE_RATE):
+    """セッションで有効にされているか、サンプリング率に当たった場合に True"""
+    return session_enabled or (sample_rate > 0 and random.random() < sample_rate)
+
+
+def maybe_profile(enabled, label):
+    """enabled でなければ何もしないコンテキスト（プロファイラのスレッドも tracemalloc も動かない）"""
+    if not enabled:
+        return contextlib.nullcontext()
+    return profile_request(label)
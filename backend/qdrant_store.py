@@ -0,0 +1,147 @@
+import time
+import uuid
+
+from qdrant_client import QdrantClient
+from qdrant_client.http import models
+
+from config import QDRANT_PATH, QDRANT_URL
+
+# 再構築時に残しておく旧バージョンの数（即時ロールバック用）
+KEEP_PREVIOUS_VERSIONS = 2
+VERSION_SEPARATOR = "__v"
+
+
+def connect_qdrant():
+    """
+    QDRANT_URL があれば Qdrant サーバーに、なければローカルの QDRANT_PATH に接続する。
+    ローカルモードはディレクトリを1プロセスが専有するため、アプリを止めずに再構築したい場合はサーバーを使う。
+    """
+    if QDRANT_URL:
+        return QdrantClient(url=QDRANT_URL)
+    return QdrantClient(path=QDRANT_PATH)
+
+
+def namespaced_point_id(namespace, key):
+    """名前空間（uuid5 の namespace）と chunk_id などのキーから、決定的なポイントID（UUID文字列）を作る"""
+    return str(uuid.uuid5(namespace, key))
+
+
+def create_payload_indexes(client, collection, payload_indexes):
+    """payload_indexes（{フィールド名: PayloadSchemaType}）の payload index を作成する（ローカルモードでは Qdrant 側で無視される）"""
+    for field_name, schema in payload_indexes.items():
+        client.create_payload_index(collection_name=collection, field_name=field_name, field_schema=schema)
+
+
+def versioned_collection_name(alias):
+    """エイリアス名から、新しいシャドウコレクション名（例: legal_rag_gemma__v20251201093000）を作る"""
+    return f"{alias}{VERSION_SEPARATOR}{time.strftime('%Y%m%d%H%M%S')}"
+
+
+def list_versions(client, alias):
+    """alias のシャドウコレクションを古い順に返す"""
+    prefix = f"{alias}{VERSION_SEPARATOR}"
+    return sorted(c.name for c in client.get_collections().collections if c.name.startswith(prefix))
+
+
+def alias_target(client, alias):
+    """alias が今指しているコレクション名（エイリアスが無ければ None）"""
+    for a in client.get_aliases().aliases:
+        if a.alias_name == alias:
+            return a.collection_name
+    return None
+
+
+def verify_collection(client, collection, expected_count, probe_vector, probe_filter=None):
+    """
+    切り替え前の検証。件数が一致し、登録済みのベクトルで検索して自分自身（score≈1）が返ることを確認する。
+    問題があれば RuntimeError を送出する。
+    """
+    count = client.count(collection_name=collection, exact=True).count
+    if count != expected_count:
+        raise RuntimeError(f"件数が一致しません: {collection} = {count} 件（期待値 {expected_count} 件）")
+
+    hits = client.query_points(
+        collection_name=collection,
+        query=probe_vector,
+        query_filter=probe_filter,
+        limit=1,
+    ).points
+    if not hits or hits[0].score < 0.99:
+        raise RuntimeError(f"スモーククエリが失敗しました: {collection} で登録済みベクトルが見つかりません。")
+
+
+def create_shadow_collection(client, alias, vector_size, payload_indexes):
+    """
+    alias の新しいシャドウコレクション（{alias}__v{日時}）を作り、payload index を張ってその名前を返す。
+    稼働中のコレクション（alias の今の参照先）には触らない。
+    """
+    collection = versioned_collection_name(alias)
+    client.create_collection(
+        collection_name=collection,
+        vectors_config=models.VectorParams(size=vector_size, distance=models.Distance.COSINE),
+    )
+    create_payload_indexes(client, collection, payload_indexes)
+    return collection
+
+
+def publish_collection(client, alias, collection, expected_count, probe_vector, probe_filter=None):
+    """
+    シャドウコレクションを検証し、通れば alias を付け替えて古いバージョンを整理する（verify_collection → switch_alias）。
+    検証に失敗した場合は alias を切り替えず、collection は調査用に残して False を返す。
+    """
+    try:
+        verify_collection(client, collection, expected_count, probe_vector, probe_filter)
+    except RuntimeError as e:
+        print(f"エラー: {e}")
+        print(f"エイリアスは切り替えません。'{collection}' は調査用に残しています。")
+        return False
+
+    switch_alias(client, alias, collection)
+    prune_versions(client, alias, keep=KEEP_PREVIOUS_VERSIONS)
+    print(f"完了: {expected_count} 件を '{collection}'（エイリアス '{alias}'）に登録しました。")
+    return True
+
+
+def switch_alias(client, alias, collection):
+    """
+    alias を collection に1回の操作で付け替える（読み手からは旧→新に瞬時に切り替わる）。
+    alias と同名の実コレクション（エイリアス導入前の形式）がある場合は、先に削除する。
+    コレクションの削除はエイリアス操作と同じ呼び出しにまとめられないため、この初回の移行だけは
+    削除からエイリアス作成までの間（通常は1秒未満）検索が失敗する。2回目以降の切り替えは無停止。
+    """
+    operations = []
+    if alias_target(client, alias) is not None:
+        operations.append(models.DeleteAliasOperation(delete_alias=models.DeleteAlias(alias_name=alias)))
+    operations.append(models.CreateAliasOperation(
+        create_alias=models.CreateAlias(collection_name=collection, alias_name=alias)
+    ))
+
+    if alias in {c.name for c in client.get_collections().collections}:
+        print(f"警告: エイリアス導入前のコレクション '{alias}' を削除してエイリアスに置き換えます（この間だけ検索が失敗します）。")
+        client.delete_collection(collection_name=alias)
+    client.update_collection_aliases(change_aliases_operations=operations)
+    print(f"エイリアス '{alias}' → '{collection}' に切り替えました。")
+
+
+def prune_versions(client, alias, keep=KEEP_PREVIOUS_VERSIONS):
+    """現在のバージョンより古いシャドウコレクションを、新しい順に keep 個だけ残して削除する"""
+    current = alias_target(client, alias)
+    versions = list_versions(client, alias)
+    if current not in versions:
+        return
+    previous = versions[:versions.index(current)]
+    for name in previous[:max(0, len(previous) - keep)]:
+        client.delete_collection(collection_name=name)
+        print(f"古いバージョン '{name}' を削除しました。")
+
+
+def rollback(client, alias):
+    """alias を1つ前のバージョンに戻す。戻せたら戻り先のコレクション名を返す"""
+    current = alias_target(client, alias)
+    versions = list_versions(client, alias)
+    if current not in versions or versions.index(current) == 0:
+        print(f"'{alias}' に戻せる旧バージョンがありません。")
+        return None
+    previous = versions[versions.index(current) - 1]
+    switch_alias(client, alias, previous)
+    return previous
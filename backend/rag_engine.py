@@ -1,14 +1,24 @@
 import torch
-from qdrant_client import QdrantClient
 from sentence_transformers import SentenceTransformer
 import streamlit as st
 from config import (
     LEGAL_COLLECTION_NAME, 
     IDEA_COLLECTION_NAME, 
-    EMBED_MODEL_ID, 
-    QDRANT_PATH
+    EMBED_MODEL_ID
 )
 from utils.prompts import IDEA_SYSTEM_PROMPT_TEMPLATE, LEGAL_SYSTEM_PROMPT_TEMPLATE
+from backend.qdrant_store import connect_qdrant
+from backend.idea_index import build_phase_filter
+from backend.multi_query import batch_search, derive_sub_queries
+from backend.legal_index import (
+    CHILD_OVERFETCH,
+    LATEST_AS_OF,
+    REF_EXPAND_TOKEN_BUDGET,
+    build_search_filter,
+    collection_fields,
+    expand_references,
+    expand_to_parents,
+)
 
 @st.cache_resource
 def get_retrieval_resources():
@@ -20,10 +30,20 @@ def get_retrieval_resources():
         device = "cpu"
 
     model = SentenceTransformer(EMBED_MODEL_ID, device=device, trust_remote_code=True)
-    client = QdrantClient(path=QDRANT_PATH)
+    client = connect_qdrant()
     return model, client
 
-def build_system_prompt(user_query, mode_label, current_phase, model, qdrant_client, cerebras_model_id, top_k=3):
+def build_system_prompt(user_query, mode_label, current_phase, model, qdrant_client, cerebras_model_id, top_k=3,
+                        expand_refs=False, ref_token_budget=REF_EXPAND_TOKEN_BUDGET, law_names=None, as_of=None,
+                        multi_query=False, history=None, notify=st.toast):
+    """
+    検索結果を埋め込んだシステムプロンプトを組み立てる。
+    expand_refs=True の場合（Legal Mode）、ヒットした条が参照している条文を ref_token_budget の範囲で追加する。
+    law_names を渡すと（Legal Mode）、その法令だけを検索する。ヒットしなければ全体検索にフォールバックする。
+    as_of（基準日）を渡すと（Legal Mode）、その日に施行されていた版の条文で回答する。None なら今日。
+    その日に施行されていた版が1件も無い場合（取り込んだ最古の版より前など）は、最新版で回答し notify で知らせる。
+    multi_query=True の場合、言い換えや直前の発言（history）を使ったサブクエリもまとめて検索する。
+    """
     is_idea_mode = "Idea" in mode_label
     
     if is_idea_mode:
@@ -32,21 +52,56 @@ def build_system_prompt(user_query, mode_label, current_phase, model, qdrant_cli
             model_id=cerebras_model_id,
             current_phase=current_phase
         )
-        formatted_query = f"task: search framework | query: {user_query}"
+        query_prefix = "task: search framework | query: "
     else:
         collection = LEGAL_COLLECTION_NAME
         sys_prompt_base = LEGAL_SYSTEM_PROMPT_TEMPLATE.format(model_id=cerebras_model_id)
-        formatted_query = f"task: search result | query: {user_query}"
+        query_prefix = "task: search result | query: "
+
+    version_note = None
 
     # Search
-    query_vector = model.encode(formatted_query, normalize_embeddings=True)
-    try:
-        resp = qdrant_client.query_points(
-            collection_name=collection,
-            query=query_vector,
-            limit=top_k,
+    # マルチクエリ時はサブクエリをまとめて1回の forward でベクトル化し、1往復のバッチ検索にする
+    queries = [user_query]
+    if multi_query:
+        queries = derive_sub_queries(
+            user_query, history, current_phase if is_idea_mode else None, legal_terms=not is_idea_mode
         )
-        results = resp.points
+    query_vectors = model.encode([f"{query_prefix}{q}" for q in queries], normalize_embeddings=True)
+
+    def search(query_filter, limit):
+        if len(query_vectors) == 1:
+            return qdrant_client.query_points(
+                collection_name=collection,
+                query=query_vectors[0],
+                query_filter=query_filter,
+                limit=limit,
+            ).points
+        return batch_search(qdrant_client, collection, query_vectors, limit, query_filter)
+
+    try:
+        if is_idea_mode:
+            # 現在のフェーズの資料と共通資料に絞る（フェーズ付きで登録されていなければ全体検索）
+            phase_filter = build_phase_filter(current_phase)
+            results = search(phase_filter, top_k) if phase_filter else []
+            if not results:
+                results = search(None, top_k)
+        else:
+            # 法令は項・号単位の子チャンクでマッチさせ、親の条に展開する
+            # 旧形式のコレクション（upsert_legal.py で再構築する前）では searchable / valid_to の条件を外す
+            fields = collection_fields(qdrant_client, collection)
+            hits = search(build_search_filter(law_names, as_of, fields), top_k * CHILD_OVERFETCH)
+            if law_names and not hits:
+                hits = search(build_search_filter(as_of=as_of, fields=fields), top_k * CHILD_OVERFETCH)
+            if not hits and "valid_to" in fields:
+                # 基準日に施行されていた版が無い → 空のコンテキストで答えさせず、最新版にフォールバックする
+                version_note = f"基準日 {as_of or '今日'} に施行されていた版が見つからないため、取り込んだ最新版の条文を使用しています。"
+                notify(version_note)
+                as_of = LATEST_AS_OF
+                hits = search(build_search_filter(law_names, as_of, fields), top_k * CHILD_OVERFETCH)
+            results = expand_to_parents(qdrant_client, collection, hits, top_k, as_of)
+            if expand_refs:
+                results = results + expand_references(qdrant_client, collection, results, ref_token_budget, as_of)
     except Exception:
         results = []
 
@@ -56,8 +111,13 @@ def build_system_prompt(user_query, mode_label, current_phase, model, qdrant_cli
         payload = res.payload
         title = payload.get("title") or f"{payload.get('law_name')} {payload.get('article_id')}"
         text = payload.get("text", "")
-        context_blocks.append(f"📜【参照データ: {title}】\n{text}")
+        if payload.get("referenced_by"):
+            context_blocks.append(f"📎【関連条文: {title}（{payload['referenced_by']} から参照）】\n{text}")
+        else:
+            context_blocks.append(f"📜【参照データ: {title}】\n{text}")
     
+    if version_note:
+        context_blocks.insert(0, f"⚠️ {version_note}回答でもその旨を伝えること。")
     context_str = "\n\n".join(context_blocks)
     
     final_system_prompt = f"""
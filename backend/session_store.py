@@ -0,0 +1,210 @@
+import contextlib
+import json
+import os
+import sqlite3
+import time
+import uuid
+
+import streamlit as st
+
+from config import SESSION_DB_PATH
+
+# メモリに持つ直近のメッセージ数（API に送る履歴ウィンドウ 10件より多く持つ）
+MAX_IN_MEMORY_MESSAGES = 20
+# 画面に毎回そのまま描画する直近のメッセージ数（それより前は「過去のやり取り」にページ送りで表示）
+RECENT_MESSAGES = 6
+HISTORY_PAGE_SIZE = 10
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    current_step_id INTEGER
+);
+CREATE TABLE IF NOT EXISTS messages (
+    session_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    refs TEXT,
+    PRIMARY KEY (session_id, seq)
+);
+"""
+
+
+def compact_refs(results, collection):
+    """
+    検索結果（ScoredPoint / Record）を、ポイントIDとスコアだけの参照に縮める。
+    本文やタイトルは表示するときに Qdrant から ID で取り直す（fetch_ref_payloads）。
+    """
+    refs = []
+    for res in results or []:
+        ref = {"id": str(res.id), "score": round(float(getattr(res, "score", 0.0) or 0.0), 4)}
+        if res.payload and res.payload.get("referenced_by"):
+            ref["referenced_by"] = res.payload["referenced_by"]
+        refs.append(ref)
+    return {"collection": collection, "points": refs} if refs else None
+
+
+def fetch_ref_payloads(qdrant_client, refs, fields=("title", "law_name", "article_id", "text")):
+    """compact_refs の参照から、表示に必要な payload だけを ID で取得する（{point_id: payload}）"""
+    if not refs:
+        return {}
+    records = qdrant_client.retrieve(
+        collection_name=refs["collection"],
+        ids=[p["id"] for p in refs["points"]],
+        with_payload=list(fields),
+        with_vectors=False,
+    )
+    return {str(r.id): r.payload or {} for r in records}
+
+
+class SessionDB:
+    """
+    会話履歴の SQLite（WAL モード）。Streamlit は再実行ごとにスレッドが変わるため、操作ごとに接続を開く。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+
+    @contextlib.contextmanager
+    def _connect(self):
+        """成功すればコミットし、最後に必ず閉じる（sqlite3 の接続の with はコミットするだけで閉じない）"""
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            conn.execute("PRAGMA synchronous=NORMAL")
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def ensure_session(self, session_id, current_step_id=None):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO sessions VALUES (?, ?, ?, ?)",
+                (session_id, now, now, current_step_id),
+            )
+
+    def current_step_id(self, session_id):
+        with self._connect() as conn:
+            row = conn.execute("SELECT current_step_id FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        return row[0] if row else None
+
+    def save_step(self, session_id, current_step_id):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE sessions SET current_step_id = ?, updated_at = ? WHERE session_id = ?",
+                (current_step_id, time.time(), session_id),
+            )
+
+    def append(self, session_id, message):
+        """
+        メッセージを末尾に追加し、割り当てた seq を返す。
+        seq は SQL の中で採番するので、同じセッションを複数のタブで開いていても衝突しない。
+        """
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO messages "
+                "SELECT ?, COALESCE(MAX(seq), -1) + 1, ?, ?, ? FROM messages WHERE session_id = ?",
+                (session_id, message["role"], message["content"],
+                 json.dumps(message["refs"], ensure_ascii=False) if message.get("refs") else None, session_id),
+            )
+            # 同じトランザクション内なので、他のタブの書き込みに割り込まれない
+            seq = conn.execute("SELECT MAX(seq) FROM messages WHERE session_id = ?", (session_id,)).fetchone()[0]
+            conn.execute("UPDATE sessions SET updated_at = ? WHERE session_id = ?", (time.time(), session_id))
+        return seq
+
+    def count(self, session_id):
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM messages WHERE session_id = ?", (session_id,)).fetchone()[0]
+
+    def load(self, session_id, start, stop):
+        """seq が [start, stop) のメッセージを順に返す"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT role, content, refs FROM messages WHERE session_id = ? AND seq >= ? AND seq < ? ORDER BY seq",
+                (session_id, start, stop),
+            ).fetchall()
+        messages = []
+        for role, content, refs in rows:
+            message = {"role": role, "content": content}
+            if refs:
+                message["refs"] = json.loads(refs)
+            messages.append(message)
+        return messages
+
+
+@st.cache_resource
+def get_session_db():
+    """SESSION_DB_PATH が設定されていれば SessionDB を返す（未設定なら None = メモリのみ）"""
+    return SessionDB(SESSION_DB_PATH) if SESSION_DB_PATH else None
+
+
+class SessionHistory:
+    """
+    1セッションの会話履歴。メッセージは {"role", "content", "refs"(任意)} の dict で、
+    refs には検索結果をポイントIDで持つ（compact_refs）。
+
+    db（SessionDB）を渡すと全件を SQLite に書き、メモリには直近 MAX_IN_MEMORY_MESSAGES 件だけを残す。
+    db が無い場合は全件をメモリに持つ。
+    """
+
+    def __init__(self, session_id=None, db=None):
+        self.session_id = session_id or uuid.uuid4().hex
+        self.db = db
+        self.total = 0
+        self.messages = []
+        if db is not None:
+            db.ensure_session(self.session_id)
+            self._reload_tail()
+
+    def __len__(self):
+        return self.total
+
+    def _reload_tail(self):
+        """件数と、メモリに持つ直近 MAX_IN_MEMORY_MESSAGES 件を DB から読み直す"""
+        self.total = self.db.count(self.session_id)
+        self.messages = self.db.load(self.session_id, max(0, self.total - MAX_IN_MEMORY_MESSAGES), self.total)
+
+    def sync(self):
+        """他のタブが同じセッションに書き込んでいれば、メモリの直近分を読み直す（db が無ければ何もしない）"""
+        if self.db is not None and self.db.count(self.session_id) != self.total:
+            self._reload_tail()
+
+    def append(self, role, content, refs=None):
+        message = {"role": role, "content": content}
+        if refs:
+            message["refs"] = refs
+        if self.db is not None:
+            seq = self.db.append(self.session_id, message)
+            if seq != self.total:
+                # 他のタブの書き込みがメモリに無い → 今のメッセージも含めて DB から読み直す
+                self._reload_tail()
+                return
+        self.total += 1
+        self.messages.append(message)
+        if self.db is not None and len(self.messages) > MAX_IN_MEMORY_MESSAGES:
+            del self.messages[:len(self.messages) - MAX_IN_MEMORY_MESSAGES]
+
+    def recent(self, count=RECENT_MESSAGES):
+        """画面にそのまま描画する直近のメッセージ"""
+        return self.messages[-count:]
+
+    def older_count(self, recent=RECENT_MESSAGES):
+        return max(0, self.total - recent)
+
+    def older_page(self, page, page_size=HISTORY_PAGE_SIZE, recent=RECENT_MESSAGES):
+        """
+        直近 recent 件より前のメッセージを、新しい方から page_size 件ずつのページで返す（page=0 が最も新しい）。
+        """
+        stop = max(0, self.older_count(recent) - page * page_size)
+        start = max(0, stop - page_size)
+        if self.db is not None:
+            return self.db.load(self.session_id, start, stop)
+        return self.messages[start:stop]
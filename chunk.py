@@ -1,126 +1,506 @@
 import xml.etree.ElementTree as ET
 import json
+import os
 import re
 
-def parse_law_xml(xml_file_path, output_json_path):
+from artifacts import ARTIFACT_DIR, save_chunks
+from config import VALID_TO_OPEN
+
+# 本則の階層（編 > 章 > 節 > 款 > 目）。e-Gov XML のタグ名とチャンクのキー名の対応
+HIERARCHY_LEVELS = [
+    ("Part", "part"),
+    ("Chapter", "chapter"),
+    ("Section", "section"),
+    ("Subsection", "subsection"),
+    ("Division", "division"),
+]
+HIERARCHY_KEYS = [key for _, key in HIERARCHY_LEVELS]
+
+MAIN_PROVISION_LABEL = "本則"
+SUBITEM_TAG_RE = re.compile(r"^Subitem(\d+)$")
+
+# e-Gov のXMLファイル名: {法令ID}_{施行日}_{改正法令ID}.xml
+XML_FILE_NAME_RE = re.compile(r"^(?P<law_id>[0-9A-Z]+)_(?P<effective_date>\d{8})_(?P<amend_id>[0-9A-Z]+)\.xml$")
+
+# --- 条文間の参照（「前条」「第三百三十一条第一項の規定」「同条」など） ---
+KANJI_NUM = "〇一二三四五六七八九十百千"
+REFERENCE_RE = re.compile(
+    rf"第[{KANJI_NUM}]+条(?:の[{KANJI_NUM}]+)*"  # 第三百三十一条、第十五条の四
+    r"|前[二三四五六七八九]?条|次条|同条"
+)
+ARTICLE_NUM_RE = re.compile(rf"第[{KANJI_NUM}]+条(?:の[{KANJI_NUM}]+)*")
+# 他法令の条文を指す参照の直前に来る文字（「金融商品取引法第…」「（平成十一年法律第二百二十五号）第…」「同法第…」）
+EXTERNAL_PREFIX_CHARS = ("法", "令", "則", "）", "規程")
+# 他法令の参照に続けて列挙される条文（「…法第百九十七条、第百九十八条第一項」
+# 「民法第九十三条第一項ただし書及び第九十四条」「破産法第百六十条（第一項第一号を除く。）、第百六十二条」）をつなぐ語
+REFERENCE_CONNECTOR_RE = re.compile(
+    rf"^(?:[{KANJI_NUM}第項号のまで、から若し又は及び並にく（）]"
+    r"|ただし書|前段|後段|本文|各号|柱書|を除く。|において準用する場合を含む。)*$"
+)
+PRECEDING_COUNT = {"前条": 1, "前二条": 2, "前三条": 3, "前四条": 4, "前五条": 5,
+                   "前六条": 6, "前七条": 7, "前八条": 8, "前九条": 9}
+
+
+def get_tag(element):
+    # XMLの名前空間対応（e-Gov XMLは名前空間を持つ場合があるため、tag名のみを取り出す）
+    return element.tag.split('}')[-1]
+
+
+def sentence_text(element):
+    """Sentence 要素のテキストを取り出す（ルビの読み仮名 <Rt> は除外する）"""
+    parts = [element.text or ""]
+    for child in element:
+        if get_tag(child) != "Rt":
+            parts.append(sentence_text(child))
+        parts.append(child.tail or "")
+    return "".join(parts).strip()
+
+
+def block_text(element):
+    """
+    ParagraphSentence / ItemSentence / SubitemNSentence のような文の入れ物を1行のテキストにする。
+    定義規定などの Column（「会社　株式会社…をいう。」）は全角スペースで区切る。
+    """
+    if element is None:
+        return ""
+    columns = [c for c in element if get_tag(c) == "Column"]
+    if columns:
+        return "　".join(
+            "".join(sentence_text(s) for s in col.iter() if get_tag(s) == "Sentence")
+            for col in columns
+        )
+    return "".join(sentence_text(s) for s in element if get_tag(s) == "Sentence")
+
+
+def table_lines(table_struct, indent):
+    """TableStruct を「列　列」形式の行リストに平坦化する"""
+    lines = []
+    for row in table_struct.iter():
+        if get_tag(row) != "TableRow":
+            continue
+        cells = []
+        for col in row:
+            if get_tag(col) == "TableColumn":
+                cells.append("".join(sentence_text(s) for s in col.iter() if get_tag(s) == "Sentence"))
+        lines.append(f"{indent}{'　'.join(cells)}")
+    return lines
+
+
+def subitem_lines(element, depth):
+    """号の下にぶら下がる Subitem1〜Subitem10（イ、ロ、（１）…）を再帰的に行リストにする"""
+    lines = []
+    for child in element:
+        match = SUBITEM_TAG_RE.match(get_tag(child))
+        if not match:
+            continue
+        tag = get_tag(child)
+        title_elem = child.find(f"{tag}Title")
+        title = title_elem.text if title_elem is not None and title_elem.text else ""
+        indent = "  " * (depth + 1)
+        lines.append(f"{indent}{title} {block_text(child.find(f'{tag}Sentence'))}")
+        lines.extend(subitem_lines(child, depth + 1))
+    return lines
+
+
+def item_lines(item):
+    """号（Item）とその配下の細分を行リストにする"""
+    title_elem = item.find("ItemTitle")
+    item_num = title_elem.text if title_elem is not None and title_elem.text else "・"
+    lines = [f"  {item_num} {block_text(item.find('ItemSentence'))}"]
+    lines.extend(subitem_lines(item, 1))
+    return lines
+
+
+def parse_paragraph(paragraph, paragraph_count):
+    """
+    項（Paragraph）を解析し、本文と号ごとの情報を返す。
+    1項しかない条では項番号を表示しない（e-Govの表示に合わせる）。
+    """
+    para_num = paragraph.get("Num", "1")
+    display_para_num = f"【第{para_num}項】" if paragraph_count > 1 and para_num != "1" else ""
+
+    lead = block_text(paragraph.find("ParagraphSentence"))
+    lines = [f"{display_para_num} {lead}".strip()]
+    items = []
+    for child in paragraph:
+        tag = get_tag(child)
+        if tag == "Item":
+            i_lines = item_lines(child)
+            title_elem = child.find("ItemTitle")
+            items.append({
+                "item_title": title_elem.text if title_elem is not None and title_elem.text else "",
+                "text": "\n".join(i_lines).strip(),
+            })
+            lines.extend(i_lines)
+        elif tag == "TableStruct":
+            lines.extend(table_lines(child, "  "))
+
+    return {
+        "paragraph_num": para_num,
+        "lead": lead,
+        "text": "\n".join(lines).strip(),
+        "items": items,
+    }
+
+
+def build_article_chunks(law_title, provision, context, article_id, caption, paragraphs):
+    """
+    1つの条から、親チャンク（条単位）と子チャンク（項・号単位）を作る。
+
+    - 親（level="article"）: 条全体のテキスト。プロンプトに載せる単位。
+    - 子（level="paragraph" / "item"）: 検索でマッチさせる小さな単位。parent_id で親の条を指す。
+    子チャンクを持つ条は searchable=False とし、検索は子チャンクで行って親に展開する。
+    """
+    hierarchy_path = " ".join(context[key] for key in HIERARCHY_KEYS if context.get(key))
+    chunk_id = f"{law_title}|{provision}|{article_id}"
+    title = f"{law_title} {article_id} {caption}".strip()
+
+    parsed = [parse_paragraph(p, len(paragraphs)) for p in paragraphs]
+    article_text = "\n".join(p["text"] for p in parsed).strip()
+
+    base = {
+        "law_name": law_title,
+        "provision": provision,
+        **{key: context.get(key, "") for key in HIERARCHY_KEYS},
+        "article_id": article_id,
+        "caption": caption,
+    }
+
+    children = []
+    for para in parsed:
+        para_label = f"第{para['paragraph_num']}項"
+        if len(parsed) > 1:
+            children.append({
+                **base,
+                "chunk_id": f"{chunk_id}|{para_label}",
+                "parent_id": chunk_id,
+                "level": "paragraph",
+                "paragraph_num": para["paragraph_num"],
+                "title": f"{title} {para_label}",
+                "text": para["text"],
+                "combined_text": f"{law_title} {hierarchy_path} {article_id} {caption} {para_label}\n{para['text']}",
+                "searchable": True,
+            })
+        for item in para["items"]:
+            item_label = f"第{item['item_title']}号"
+            children.append({
+                **base,
+                "chunk_id": f"{chunk_id}|{para_label}|{item_label}",
+                "parent_id": chunk_id,
+                "level": "item",
+                "paragraph_num": para["paragraph_num"],
+                "item_title": item["item_title"],
+                "title": f"{title} {para_label} {item_label}",
+                "text": item["text"],
+                # 号だけだと意味が取れないので、柱書き（項の本文）を検索用テキストに含める
+                "combined_text": f"{law_title} {hierarchy_path} {article_id} {caption} {para_label}\n{para['lead']}\n{item['text']}",
+                "searchable": True,
+            })
+
+    article = {
+        **base,
+        "chunk_id": chunk_id,
+        "parent_id": None,
+        "level": "article",
+        "title": title,
+        "text": article_text,       # 人間が読む用の整形済みテキスト
+        # RAG検索用テキストの作成
+        # 検索時は「第○条」や「見出し」もヒットしてほしいので、全て結合する
+        "combined_text": f"{law_title} {hierarchy_path} {article_id} {caption}\n{article_text}",
+        "searchable": not children,
+    }
+    return [article] + children
+
+
+def extract_references(text):
     """
-    e-Govの法令XMLを解析し、RAG向けのチャンク（条単位）のJSONリストを作成する。
+    条文テキストから参照表現を取り出す。他法令への参照は除外する。
+    戻り値は出現順の参照表現（"第三百三十一条", "前条", "前二条", "次条", "同条"）のリスト。
+    """
+    refs = []
+    prev_end = 0
+    prev_external = False
+    for match in REFERENCE_RE.finditer(text):
+        token = match.group(0)
+        gap = text[prev_end:match.start()]
+        if token.startswith("第"):
+            if prev_external and REFERENCE_CONNECTOR_RE.match(gap):
+                external = True
+            else:
+                external = text[:match.start()].endswith(EXTERNAL_PREFIX_CHARS)
+            prev_external = external
+            if not external:
+                refs.append(token)
+        elif token == "同条" and prev_external and REFERENCE_CONNECTOR_RE.match(gap):
+            # 他法令の列挙の中の「同条」（「第百六十四条第一項（同条第二項において…）」）は他法令の条
+            pass
+        else:
+            prev_external = False
+            refs.append(token)
+        prev_end = match.end()
+    return refs
+
+
+def link_references(chunks):
+    """
+    各チャンクの参照表現を、同じ法令の条の chunk_id に解決して "refs" に格納する（参照グラフの隣接リスト）。
+    - 「第X条」は本則の条にのみ解決する（附則中の条番号は改正法側を指すことが多いため解決しない）。
+    - 「前条」「前二条」「次条」は同じ本則・附則の中の並び順で解決する。
+    - 「同条」は直前に解決した条を指す。
+    条単位の refs は、その条と子チャンクの参照の和集合になる。
+    """
+    articles_by_provision = {}
+    for chunk in chunks:
+        if chunk["level"] == "article":
+            key = (chunk["law_name"], chunk["provision"])
+            articles_by_provision.setdefault(key, []).append(chunk["chunk_id"])
+
+    position = {}
+    for ids in articles_by_provision.values():
+        for i, chunk_id in enumerate(ids):
+            position[chunk_id] = i
+    main_articles = {}
+    for (law_name, provision), ids in articles_by_provision.items():
+        if provision == MAIN_PROVISION_LABEL:
+            for chunk_id in ids:
+                main_articles[(law_name, chunk_id.rsplit("|", 1)[-1])] = chunk_id
+
+    for chunk in chunks:
+        article_chunk_id = chunk["parent_id"] or chunk["chunk_id"]
+        siblings = articles_by_provision[(chunk["law_name"], chunk["provision"])]
+        index = position[article_chunk_id]
+
+        resolved = []
+        last = None
+        for token in extract_references(chunk["text"]):
+            targets = []
+            if token.startswith("第"):
+                if chunk["provision"] == MAIN_PROVISION_LABEL:
+                    target = main_articles.get((chunk["law_name"], ARTICLE_NUM_RE.match(token).group(0)))
+                    targets = [target] if target else []
+            elif token in PRECEDING_COUNT:
+                n = PRECEDING_COUNT[token]
+                targets = siblings[max(0, index - n):index]
+            elif token == "次条":
+                targets = siblings[index + 1:index + 2]
+            elif token == "同条":
+                targets = [last] if last else []
+
+            for target in targets:
+                if target != article_chunk_id and target not in resolved:
+                    resolved.append(target)
+            if targets:
+                last = targets[-1]
+        chunk["refs"] = resolved
+
+    # 条単位の refs に子チャンクの参照をまとめる
+    articles = {c["chunk_id"]: c for c in chunks if c["level"] == "article"}
+    for chunk in chunks:
+        if chunk["parent_id"]:
+            parent = articles[chunk["parent_id"]]
+            for target in chunk["refs"]:
+                if target not in parent["refs"]:
+                    parent["refs"].append(target)
+
+
+def walk_provision(element, law_title, provision, context, chunks):
     """
-    
+    編・章・節・款・目を再帰的にたどり、条（Article）をチャンク化する。
+    階層の見出しは context に積み、下位の階層に入るたびに引き継ぐ。
+    """
+    for child in element:
+        tag = get_tag(child)
+        level_key = dict(HIERARCHY_LEVELS).get(tag)
+        if level_key:
+            title_elem = child.find(f"{tag}Title")
+            child_context = dict(context)
+            child_context[level_key] = title_elem.text if title_elem is not None and title_elem.text else ""
+            # 上位の階層が変わったら、それより下位の見出しはリセットする
+            for key in HIERARCHY_KEYS[HIERARCHY_KEYS.index(level_key) + 1:]:
+                child_context[key] = ""
+            walk_provision(child, law_title, provision, child_context, chunks)
+        elif tag == "Article":
+            title_elem = child.find("ArticleTitle")
+            caption_elem = child.find("ArticleCaption")
+            article_id = title_elem.text if title_elem is not None and title_elem.text else ""
+            if provision != MAIN_PROVISION_LABEL:
+                article_id = f"附則{article_id}"
+            caption = caption_elem.text if caption_elem is not None and caption_elem.text else ""
+            chunks.extend(build_article_chunks(
+                law_title, provision, context, article_id, caption, child.findall("Paragraph")
+            ))
+
+
+def parse_suppl_provision(suppl, law_title, chunks):
+    """
+    附則（SupplProvision）を解析する。改正法ごとに AmendLawNum で区別する。
+    条立ての附則は条ごとに、項だけの附則は附則全体を1つの条として扱う。
+    """
+    amend_law_num = suppl.get("AmendLawNum")
+    provision = f"附則（{amend_law_num}）" if amend_law_num else "附則"
+
+    if suppl.find("Article") is not None:
+        walk_provision(suppl, law_title, provision, {}, chunks)
+        return
+
+    paragraphs = suppl.findall("Paragraph")
+    if paragraphs:
+        chunks.extend(build_article_chunks(law_title, provision, {}, provision, "", paragraphs))
+
+
+def parse_law_file(xml_file_path):
+    """
+    e-Govの法令XML（1つの施行日版）を解析し、RAG向けのチャンクのリストを返す。
+    本則は編・章・節・款・目のどこに置かれた条も拾い、附則も含める。
+    条単位の親チャンクに加えて、項・号単位の子チャンク（parent_id 付き）を作る。
+    """
+
     # XMLの読み込み
     try:
         tree = ET.parse(xml_file_path)
         root = tree.getroot()
     except Exception as e:
         print(f"Error loading XML: {e}")
-        return
-
-    # XMLの名前空間対応（e-Gov XMLは名前空間を持つ場合があるため、tag名のみで検索するヘルパー）
-    def get_tag(element):
-        return element.tag.split('}')[-1]
+        return None
 
     # 法令名を取得
     law_title_elem = root.find(".//LawTitle")
     law_title = law_title_elem.text if law_title_elem is not None else "不明な法令"
-    
+
     chunks = []
 
     # MainProvision（本則）の中を走査
     main_provision = root.find(".//MainProvision")
     if main_provision is None:
         print("MainProvisionが見つかりませんでした。")
-        return
+        return None
+
+    walk_provision(main_provision, law_title, MAIN_PROVISION_LABEL, {}, chunks)
+
+    # SupplProvision（附則）
+    for suppl in root.iter():
+        if get_tag(suppl) == "SupplProvision":
+            parse_suppl_provision(suppl, law_title, chunks)
+
+    # 条文間の参照グラフ（隣接リスト）を作る
+    link_references(chunks)
+    return chunks
+
+
+def parse_xml_file_name(xml_file_name):
+    """
+    e-Gov のファイル名（{法令ID}_{施行日YYYYMMDD}_{改正法令ID}.xml）から法令IDと施行日を取り出す。
+    形式が違う場合は (ファイル名, None) を返す。
+    """
+    match = XML_FILE_NAME_RE.match(os.path.basename(xml_file_name))
+    if not match:
+        return os.path.splitext(os.path.basename(xml_file_name))[0], None
+    return match.group("law_id"), int(match.group("effective_date"))
 
-    # 章（Chapter）ごとのループ
-    # ※章がない法令の場合は直接Articleを探すロジックが必要だが、労基法には章があるためこの構造でOK
-    current_chapter_name = ""
-    
-    # XMLの構造をフラットに処理するため、Chapterを探しつつ、その中のArticleを探す
-    for chapter in main_provision.findall(".//Chapter"):
-        chapter_title_elem = chapter.find("ChapterTitle")
-        if chapter_title_elem is not None:
-            current_chapter_name = chapter_title_elem.text
-        
-        # 条（Article）ごとのループ
-        for article in chapter.findall("Article"):
-            article_data = {
-                "law_name": law_title,
-                "chapter": current_chapter_name,
-                "article_id": "",
-                "caption": "",
-                "text": "",      # 人間が読む用の整形済みテキスト
-                "combined_text": "" # ベクトル化（検索）用の統合テキスト
-            }
-
-            # 条名（例：第一条）
-            article_title = article.find("ArticleTitle")
-            if article_title is not None:
-                article_data["article_id"] = article_title.text
-
-            # 条見出し（例：労働条件の原則）
-            article_caption = article.find("ArticleCaption")
-            if article_caption is not None:
-                article_data["caption"] = article_caption.text
-
-            # --- 本文の構築ロジック ---
-            text_parts = []
-            
-            # 項（Paragraph）の処理
-            for paragraph in article.findall("Paragraph"):
-                para_num_elem = paragraph.find("ParagraphNum")
-                para_num = para_num_elem.text if para_num_elem is not None else ""
-                
-                # 項番号の整形（1項は番号がない場合が多いので処理）
-                display_para_num = f"【第{para_num}項】" if para_num and para_num != "1" else ""
-                
-                para_sentences = []
-                for sentence in paragraph.findall(".//Sentence"):
-                    if sentence.text:
-                        para_sentences.append(sentence.text)
-                
-                full_para_text = "".join(para_sentences)
-                text_parts.append(f"{display_para_num} {full_para_text}")
-
-                # 号（Item）の処理（項の中にぶら下がる場合）
-                for item in paragraph.findall("Item"):
-                    item_title = item.find("ItemTitle")
-                    item_num = item_title.text if item_title is not None else "・"
-                    
-                    item_sentences = []
-                    for i_sent in item.findall(".//Sentence"):
-                        if i_sent.text:
-                            item_sentences.append(i_sent.text)
-                    
-                    text_parts.append(f"  {item_num} {''.join(item_sentences)}")
-
-            # テキストの結合
-            article_data["text"] = "\n".join(text_parts).strip()
-            
-            # RAG検索用テキストの作成
-            # 検索時は「第○条」や「見出し」もヒットしてほしいので、全て結合する
-            article_data["combined_text"] = f"{law_title} {current_chapter_name} {article_data['article_id']} {article_data['caption']}\n{article_data['text']}"
-            
-            chunks.append(article_data)
-
-    # JSONとして保存
+
+def chunk_content_key(chunk):
+    """有効期間以外の中身が同じチャンクは同じキーになる（版をまたいだ重複排除に使う）"""
+    content = {k: v for k, v in chunk.items() if k not in ("valid_from", "valid_to")}
+    return (chunk["chunk_id"], json.dumps(content, ensure_ascii=False, sort_keys=True))
+
+
+def merge_versions(versions):
+    """
+    施行日ごとのチャンクを、有効期間 [valid_from, valid_to) 付きの1つのリストにまとめる。
+
+    改正されなかったチャンクは版をまたいで1件のまま valid_to を延ばすだけなので、
+    件数は「版の数 × 条文数」ではなく「条文数 + 改正された箇所の数」に比例する。
+    最新版まで有効なチャンクの valid_to は VALID_TO_OPEN（9999-12-31）にする。
+
+    Args:
+        versions: [(施行日 YYYYMMDD, チャンクのリスト), ...]
+    """
+    merged = []
+    open_records = {}
+    for effective_date, chunks in sorted(versions, key=lambda v: v[0]):
+        current = {}
+        for chunk in chunks:
+            current[chunk_content_key(chunk)] = chunk
+
+        # この版で消えた（改正・削除された）チャンクは期間を閉じる
+        for key in list(open_records):
+            if key not in current:
+                open_records.pop(key)["valid_to"] = effective_date
+
+        for key, chunk in current.items():
+            if key not in open_records:
+                record = {**chunk, "valid_from": effective_date, "valid_to": VALID_TO_OPEN}
+                open_records[key] = record
+                merged.append(record)
+    return merged
+
+
+def parse_law_xml(xml_file_paths, output_json_path):
+    """
+    同じ法令の1つ以上の施行日版XMLを解析し、有効期間付きチャンクのJSONリストを作成する。
+    """
+    if isinstance(xml_file_paths, str):
+        xml_file_paths = [xml_file_paths]
+
+    versions = []
+    for xml_file_path in xml_file_paths:
+        law_id, effective_date = parse_xml_file_name(xml_file_path)
+        chunks = parse_law_file(xml_file_path)
+        if chunks is None:
+            continue
+        for chunk in chunks:
+            chunk["law_id"] = law_id
+        versions.append((effective_date or 0, chunks))
+
+    if not versions:
+        return None
+
+    chunks = merge_versions(versions)
+
+    # JSONとして保存（インデントなしで1チャンク1行。サイズを抑えつつ、差分はチャンク単位で読める）
     with open(output_json_path, 'w', encoding='utf-8') as f:
-        json.dump(chunks, f, ensure_ascii=False, indent=2)
+        f.write("[\n")
+        f.write(",\n".join(json.dumps(chunk, ensure_ascii=False, separators=(",", ":")) for chunk in chunks))
+        f.write("\n]\n")
+
+    latest = [c for c in chunks if c["valid_to"] == VALID_TO_OPEN]
+    article_count = sum(1 for c in latest if c["level"] == "article")
+    edge_count = sum(len(c["refs"]) for c in latest if c["level"] == "article")
+    print(f"処理完了: {article_count} 件の条文（子チャンク含め {len(latest)} 件、参照 {edge_count} 件）を {output_json_path} に保存しました。")
+    if len(versions) > 1:
+        naive = sum(len(v[1]) for v in versions)
+        print(f"  {len(versions)} 版を統合: {naive} 件 → {len(chunks)} 件（改正のない条文は共有）")
 
-    print(f"処理完了: {len(chunks)} 件の条文データを {output_json_path} に保存しました。")
-    
     # 確認のため最初の1件を表示
     if chunks:
         print("\n--- サンプルデータ (最初の1件) ---")
         print(json.dumps(chunks[0], ensure_ascii=False, indent=2))
 
+    return chunks
+
 # --- 実行部分 ---
-# アップロードされたファイル名を指定してください
-input_files = [
-    ("322AC0000000049_20250601_504AC0000000068.xml", "labor_standards_act_chunks.json"),
-    ("351AC0000000057_20250601_504AC0000000068.xml", "specific_commercial_transaction_act_chunks.json"),
-    ("417AC0000000086_20251001_505AC0000000053.xml", "companies_act_chunks.json"),
-]
+XML_DIR = "法律"
+CHUNK_DIR = "chunk"
+# 法令ID → 出力ファイル名。法律/ に同じ法令IDの施行日違いのXMLを置けば、まとめて1つのJSONになる
+output_files = {
+    "322AC0000000049": "labor_standards_act_chunks.json",
+    "351AC0000000057": "specific_commercial_transaction_act_chunks.json",
+    "417AC0000000086": "companies_act_chunks.json",
+}
 
 if __name__ == "__main__":
-    for xml_file, json_file in input_files:
-        parse_law_xml(xml_file, json_file)
\ No newline at end of file
+    os.makedirs(CHUNK_DIR, exist_ok=True)
+
+    xml_files_by_law = {}
+    for xml_file in sorted(f for f in os.listdir(XML_DIR) if f.endswith(".xml")):
+        law_id, _ = parse_xml_file_name(xml_file)
+        xml_files_by_law.setdefault(law_id, []).append(os.path.join(XML_DIR, xml_file))
+
+    all_chunks = []
+    for law_id, xml_paths in xml_files_by_law.items():
+        json_file = output_files.get(law_id, f"{law_id}_chunks.json")
+        all_chunks.extend(parse_law_xml(xml_paths, os.path.join(CHUNK_DIR, json_file)) or [])
+
+    # upsert_legal.py が読む SQLite アーティファクトも更新する
+    save_chunks(all_chunks, ARTIFACT_DIR)
+    print(f"\n{len(all_chunks)} 件のチャンクを {ARTIFACT_DIR} に保存しました。")
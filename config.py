@@ -7,6 +7,9 @@ load_dotenv()
 LEGAL_COLLECTION_NAME = "legal_rag_gemma"
 IDEA_COLLECTION_NAME = "idea_frameworks"
 
+# 法令チャンクの有効期間 [valid_from, valid_to) の終端（最新版まで有効なチャンクに入れる番兵値）
+VALID_TO_OPEN = 99991231
+
 # Models
 EMBED_MODEL_ID = "google/embeddinggemma-300m"
 CEREBRAS_MODEL_CHOICES = [
@@ -19,14 +22,32 @@ CEREBRAS_MODEL_CHOICES = [
 
 # API Keys & Endpoints
 CEREBRAS_API_KEY = os.getenv("CEREBRAS_API_KEY")
+# 設定すると Cerebras API の代わりにこの URL に送る（mock_cerebras.py でのローカル検証用）
+CEREBRAS_BASE_URL = os.getenv("CEREBRAS_BASE_URL")
 PERPLEXITY_API_KEY = os.getenv("PERPLEXITY_API_KEY")
 JINA_API_KEY = os.getenv("JINA_API_KEY")  # Optional
 HF_TOKEN = os.getenv("HF_TOKEN") or os.getenv("HUGGINGFACE_HUB_TOKEN")
 
+# Cerebras 呼び出しのスケジューラ（プロセス全体で共有）
+# 発行ペース（件/秒）と溜められる最大件数、同時実行数の上限
+CEREBRAS_RATE_PER_SEC = float(os.getenv("CEREBRAS_RATE_PER_SEC", "2"))
+CEREBRAS_BURST = int(os.getenv("CEREBRAS_BURST", "5"))
+CEREBRAS_MAX_CONCURRENCY = int(os.getenv("CEREBRAS_MAX_CONCURRENCY", "4"))
+
 # Qdrant settings
 # QDRANT_HOST = os.getenv("QDRANT_HOST", "localhost")
 # QDRANT_PORT = int(os.getenv("QDRANT_PORT", "6333"))
 QDRANT_PATH = "./qdrant_storage"
+# 設定するとローカルの QDRANT_PATH ではなく Qdrant サーバーに接続する（例: http://qdrant:6333）
+QDRANT_URL = os.getenv("QDRANT_URL")
+
+# 会話履歴の保存先（SQLite）。設定するとセッションを再開でき、メモリには直近の会話だけを持つ
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH")
+
+# リクエスト単位のプロファイル（フレームグラフ・collapsed stacks・メモリ差分）の保存先と、
+# 全セッションからランダムに計測する割合（0 なら、サイドバーで有効にしたセッションだけ）
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
 
 # Analysis Steps (The Loop)
 ANALYSIS_STEPS = {
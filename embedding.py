@@ -1,11 +1,122 @@
 import json
+import multiprocessing
+import os
+import time
 import torch
 from sentence_transformers import SentenceTransformer
 import numpy as np
 
-def generate_embeddings(input_json_path, output_json_path, model_id):
+from artifacts import save_chunks, save_vectors, texts_fingerprint
+
+# --- バルク Embedding の設定 ---
+# 1バッチの forward に使ってよいメモリの目安（MB）。パディング込みの「バッチ数 × 最長トークン数」をここから決める
+DEFAULT_MEMORY_BUDGET_MB = 1024
+MAX_BATCH_SIZE = 128
+# 1トークンあたりの活性化メモリ ≒ hidden_size × 4byte × この係数（層ごとの中間出力・attention を含めたざっくりした見積もり）
+ACTIVATION_MULTIPLIER = 16
+
+
+def token_lengths(model, texts):
+    """各テキストのトークン数（max_seq_length で頭打ち）。トークナイザが使えなければ文字数で代用する"""
+    max_len = model.max_seq_length or 512
+    try:
+        encoded = model.tokenizer(texts, add_special_tokens=True, truncation=False)["input_ids"]
+        return [min(len(ids), max_len) for ids in encoded]
+    except Exception:
+        return [min(len(t), max_len) for t in texts]
+
+
+def tokens_per_batch(model, memory_budget_mb):
+    """メモリ予算から、1バッチに入れてよいパディング込みトークン数を見積もる"""
+    hidden_size = model.get_sentence_embedding_dimension() or 768
+    bytes_per_token = hidden_size * 4 * ACTIVATION_MULTIPLIER
+    return max(1, int(memory_budget_mb * 1024 * 1024 / bytes_per_token))
+
+
+def plan_batches(lengths, max_tokens, max_batch_size=MAX_BATCH_SIZE):
+    """
+    トークン長でソートし、長さの近いテキスト同士をまとめたバッチ（元のインデックスのリスト）を作る。
+    各バッチは「件数 × バッチ内の最長トークン数」が max_tokens 以下になるように切る。
+    短い条文は大きなバッチに、長い条文は小さなバッチになるので、パディングの無駄と長文による詰まりが減る。
+    """
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+    batches = []
+    current = []
+    for i in order:
+        # 長さ昇順なので、i を足したときのバッチ内最長は lengths[i]
+        if current and ((len(current) + 1) * lengths[i] > max_tokens or len(current) >= max_batch_size):
+            batches.append(current)
+            current = []
+        current.append(i)
+    if current:
+        batches.append(current)
+    return batches
+
+
+# --- マルチプロセス encode（CPU 向け） ---
+_worker_model = None
+
+
+def _init_worker(model_id, threads_per_worker):
+    """ワーカープロセスごとにモデルを1回だけロードする"""
+    global _worker_model
+    torch.set_num_threads(threads_per_worker)
+    _worker_model = SentenceTransformer(model_id, device="cpu", trust_remote_code=True)
+
+
+def _encode_batch(job):
+    batch_no, texts = job
+    vectors = _worker_model.encode(
+        texts, batch_size=len(texts), convert_to_numpy=True, normalize_embeddings=True
+    )
+    return batch_no, vectors
+
+
+def encode_bucketed(model, texts, memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB, num_workers=1, model_id=None):
     """
-    指定されたモデルを使ってテキストをベクトル化し、元のJSONに結合して保存する。
+    長さでバケット分けしたバッチでテキストをベクトル化し、元の順序のまま (件数, 次元数) の行列を返す。
+
+    num_workers > 1 の場合は CPU コアを分け合う複数プロセスで並列に encode する
+    （各プロセスがモデルを持つので、メモリに余裕がある場合のみ。model_id が必要）。
+    最後に処理速度（chunks/s）とパディング効率を表示する。
+    """
+    start = time.time()
+    lengths = token_lengths(model, texts)
+    max_tokens = tokens_per_batch(model, memory_budget_mb)
+    batches = plan_batches(lengths, max_tokens)
+    padded = sum(len(b) * max(lengths[i] for i in b) for b in batches)
+    print(f"{len(texts)} texts → {len(batches)} batches (≤{max_tokens} padded tokens/batch, "
+          f"padding efficiency {sum(lengths) / max(padded, 1):.0%})")
+
+    embeddings = np.zeros((len(texts), model.get_sentence_embedding_dimension()), dtype=np.float32)
+    jobs = [(n, [texts[i] for i in batch]) for n, batch in enumerate(batches)]
+
+    if num_workers > 1:
+        if model_id is None:
+            raise ValueError("num_workers > 1 には model_id が必要です。")
+        threads_per_worker = max(1, (os.cpu_count() or num_workers) // num_workers)
+        ctx = multiprocessing.get_context("spawn")
+        with ctx.Pool(num_workers, initializer=_init_worker, initargs=(model_id, threads_per_worker)) as pool:
+            for done, (batch_no, vectors) in enumerate(pool.imap_unordered(_encode_batch, jobs), 1):
+                embeddings[batches[batch_no]] = vectors
+                if done % 10 == 0 or done == len(jobs):
+                    print(f"  {done}/{len(jobs)} batches")
+    else:
+        for done, (batch_no, batch_texts) in enumerate(jobs, 1):
+            embeddings[batches[batch_no]] = model.encode(
+                batch_texts, batch_size=len(batch_texts), convert_to_numpy=True, normalize_embeddings=True
+            )
+            if done % 10 == 0 or done == len(jobs):
+                print(f"  {done}/{len(jobs)} batches")
+
+    elapsed = time.time() - start
+    print(f"Encoded {len(texts)} chunks in {elapsed:.1f}s ({len(texts) / max(elapsed, 1e-9):.1f} chunks/s)")
+    return embeddings
+
+def generate_embeddings(input_json_path, output_dir, model_id):
+    """
+    指定されたモデルを使ってテキストをベクトル化し、アーティファクト形式で保存する。
+    チャンクは output_dir/chunks.sqlite、ベクトルは output_dir/vectors.npy（メモリマップ可能）に書き出す。
     """
     
     # 1. デバイスの設定 (MacBookではMPS(Apple Silicon GPU)またはCPUを使用)
@@ -43,36 +154,25 @@ def generate_embeddings(input_json_path, output_json_path, model_id):
     # 5. Embeddingの実行
     print("Starting embedding process...")
     
-    # MacBook用にバッチサイズを調整
-    batch_size = 4 if device == "mps" else 8
-    
-    embeddings = model.encode(
-        texts, 
-        batch_size=batch_size, 
-        show_progress_bar=True, 
-        convert_to_numpy=True,
-        normalize_embeddings=True
-    )
+    # MacBook用にメモリ予算を控えめにする（長さの近いテキストでバッチを組むのでバッチサイズは自動）
+    memory_budget_mb = 256 if device == "mps" else DEFAULT_MEMORY_BUDGET_MB
+    embeddings = encode_bucketed(model, texts, memory_budget_mb=memory_budget_mb)
 
-    # 6. 結果を結合
+    # 6. 保存（ベクトルはJSONの数値リストにせず、.npy の行列として書き出す）
     print("Saving results...")
-    for i, chunk in enumerate(chunks):
-        chunk["vector"] = embeddings[i].tolist()
-
-    # 7. 保存
-    with open(output_json_path, 'w', encoding='utf-8') as f:
-        json.dump(chunks, f, ensure_ascii=False, indent=2)
+    save_chunks(chunks, output_dir)
+    save_vectors(embeddings, output_dir, model_id=model_id, fingerprint=texts_fingerprint(texts))
 
-    print(f"Done! Vectors saved to {output_json_path}")
+    print(f"Done! Vectors saved to {output_dir}")
     print(f"Vector dimensions: {embeddings.shape[1]}")
 
 # --- 設定と実行 ---
 if __name__ == "__main__":
     # 処理するファイルリスト
     files_to_process = [
-        ("labor_standards_act_chunks.json", "labor_standards_act_vectors.json"),
-        ("specific_commercial_transaction_act_chunks.json", "specific_commercial_transaction_act_vectors.json"),
-        ("companies_act_chunks.json", "companies_act_vectors.json"),
+        ("chunk/labor_standards_act_chunks.json", "artifacts/labor_standards_act"),
+        ("chunk/specific_commercial_transaction_act_chunks.json", "artifacts/specific_commercial_transaction_act"),
+        ("chunk/companies_act_chunks.json", "artifacts/companies_act"),
     ]
     
     MODEL_ID = "sbintuitions/sarashina-embedding-v2-1b"  # 日本語対応の軽量モデル
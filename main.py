@@ -1,25 +1,56 @@
+import datetime
 import streamlit as st
 import random
 from config import (
     CEREBRAS_MODEL_CHOICES, 
-    ANALYSIS_STEPS
+    ANALYSIS_STEPS,
+    LEGAL_COLLECTION_NAME,
+    IDEA_COLLECTION_NAME
 )
 from backend.rag_engine import get_retrieval_resources, build_system_prompt
 from backend.chat_engine import chat_with_cerebras
+from backend.llm_scheduler import get_scheduler
+from backend.profiler import maybe_profile, should_profile
+from backend.model_router import AUTO_MODEL, describe_model_stats
+from backend.law_router import route_law_query, describe_search_space
+from backend.prefetch import deep_dive_prompt, get_prefetcher, next_step_prompt
+from backend.session_store import (
+    HISTORY_PAGE_SIZE,
+    SessionHistory,
+    compact_refs,
+    fetch_ref_payloads,
+    get_session_db,
+)
 
 # --- Session State Initialization ---
 def init_session_state():
-    if "messages" not in st.session_state:
-        st.session_state.messages = []
-        # Initial Message
-        st.session_state.messages.append({
-            "role": "assistant", 
-            "content": "ようこそ、起業家の卵よ。準備運動は済んだか？\n\nまずは**アイデアを一言**置いていけ。そこから全てが始まる。"
-        })
+    if "history" not in st.session_state:
+        # SESSION_DB_PATH が設定されていれば SQLite に保存し、URL の ?session= で同じ会話を再開できる
+        db = get_session_db()
+        session_id = st.query_params.get("session") if db is not None else None
+        history = SessionHistory(session_id, db)
+        if len(history) == 0:
+            # Initial Message
+            history.append(
+                "assistant",
+                "ようこそ、起業家の卵よ。準備運動は済んだか？\n\nまずは**アイデアを一言**置いていけ。そこから全てが始まる。"
+            )
+        elif db is not None and db.current_step_id(history.session_id):
+            st.session_state.current_step_id = db.current_step_id(history.session_id)
+        if db is not None:
+            st.query_params["session"] = history.session_id
+        st.session_state.history = history
     
     if "current_step_id" not in st.session_state:
         st.session_state.current_step_id = 1 # STEEP分析から開始
 
+
+def save_step():
+    """現在のステップを SQLite に残す（保存しない設定なら何もしない）"""
+    history = st.session_state.history
+    if history.db is not None:
+        history.db.save_step(history.session_id, st.session_state.current_step_id)
+
 # --- UI Components ---
 def render_sidebar():
     st.sidebar.markdown("## ⚙️ Cockpit Settings")
@@ -34,8 +65,32 @@ def render_sidebar():
     st.sidebar.markdown("---")
     
     # Model & Retrieval Settings
-    cerebras_model_id = st.sidebar.selectbox("Brain (Model)", CEREBRAS_MODEL_CHOICES, index=0)
+    cerebras_model_id = st.sidebar.selectbox(
+        "Brain (Model)", CEREBRAS_MODEL_CHOICES + [AUTO_MODEL], index=0,
+        help="auto: 質問の重さに合う品質のモデルのうち、実測で一番速いものを使う（失敗・遅延時は次のモデルへ）。"
+    )
+    if cerebras_model_id == AUTO_MODEL:
+        with st.sidebar.expander("📈 モデル実測 (auto)"):
+            for line in describe_model_stats():
+                st.caption(line)
+    st.sidebar.caption(f"🚦 Cerebras キュー: {get_scheduler().describe()}")
     top_k = st.sidebar.slider("知識レベル (Retrieval Depth)", 1, 10, 3)
+    multi_query = st.sidebar.checkbox(
+        "マルチクエリ検索", value=False,
+        help="質問の言い換えや直前の発言を使った複数のクエリで、まとめて検索します。"
+    )
+    expand_refs = False
+    as_of = None
+    if "Legal" in mode:
+        expand_refs = st.sidebar.checkbox(
+            "参照条文も読む (前条・第◯条の規定 など)", value=False,
+            help="ヒットした条文が参照している条文も、一定量までプロンプトに追加します。"
+        )
+        as_of = st.sidebar.date_input(
+            "基準日 (As of)", value=datetime.date.today(),
+            help="指定した日に施行されていた版の条文で回答します。その日の版が無ければ、取り込んだ最新版で回答します。"
+        )
+    st.session_state.as_of = as_of
     
     # Analysis Step Indicator (Only for Idea Mode)
     if "Idea" in mode:
@@ -50,11 +105,25 @@ def render_sidebar():
             else:
                 st.sidebar.markdown(f"⬜ {step_id}. {step_name}")
 
+        st.session_state.speculative_llm = st.sidebar.checkbox(
+            "🔮 「次へ」の回答も先読みする", value=False,
+            help="回答を読んでいる間に、「次へ」ボタンの回答をバックグラウンドで先に生成します。"
+                 "押されなければ Cerebras の呼び出しが無駄になります（1セッションの回数に上限あり）。"
+        )
+        st.sidebar.caption(get_prefetcher().summary())
+
         if st.sidebar.button("Step Reset 🔄"):
             st.session_state.current_step_id = 1
+            save_step()
             st.rerun()
+
+    st.sidebar.markdown("---")
+    st.sidebar.checkbox(
+        "🔬 プロファイル (このセッション)", key="profile_session",
+        help="次の実行から、時間のかかった実行ごとにフレームグラフ・collapsed stacks・メモリ差分を profiles/ に保存します。"
+    )
             
-    return mode, cerebras_model_id, top_k
+    return mode, cerebras_model_id, top_k, expand_refs, multi_query
 
 def render_next_move_buttons(mode):
     """動的に次のアクションボタンを生成する"""
@@ -68,14 +137,17 @@ def render_next_move_buttons(mode):
     next_step_name = ANALYSIS_STEPS.get(current_id + 1, "コンプリート")
     current_step_name = ANALYSIS_STEPS.get(current_id, "不明")
 
+    # 回答を読んでいる間に、ボタンの入力を先に処理しておく
+    schedule_next_move_prefetch(mode, current_id)
+
     cols = st.columns(3)
     
     # Button 1: Proceed to Next Step
     if current_id < 10:
         if cols[0].button(f"💪 次へ: {next_step_name}"):
             st.session_state.current_step_id += 1
-            next_input = f"よし、次のメニュー「{next_step_name}」に進みたい。俺のアイデアをこのフレームワークで叩き直してくれ。"
-            handle_user_input(next_input, mode, st.session_state.cerebras_model_id, st.session_state.top_k)
+            next_input = next_step_prompt(next_step_name)
+            handle_user_input(next_input, mode, st.session_state.cerebras_model_id, st.session_state.top_k, st.session_state.expand_refs, st.session_state.multi_query, use_prefetch=True)
             st.rerun()
     else:
         if cols[0].button("🏆 免許皆伝"):
@@ -84,8 +156,8 @@ def render_next_move_buttons(mode):
 
     # Button 2: Deep Dive Current Step
     if cols[1].button(f"🔎 深掘り: {current_step_name}"):
-        deep_input = f"今の「{current_step_name}」がまだ甘い気がする。もっと容赦なく、詳細に分析してくれ。"
-        handle_user_input(deep_input, mode, st.session_state.cerebras_model_id, st.session_state.top_k)
+        deep_input = deep_dive_prompt(current_step_name)
+        handle_user_input(deep_input, mode, st.session_state.cerebras_model_id, st.session_state.top_k, st.session_state.expand_refs, st.session_state.multi_query, use_prefetch=True)
         st.rerun()
 
     # Button 3: Exit / Reset
@@ -93,44 +165,178 @@ def render_next_move_buttons(mode):
         st.info("いい判断だ。休息も仕事のうち。脳を冷やして出直してこい。")
 
 
-def handle_user_input(user_input, mode, cerebras_model_id, top_k):
+def build_api_messages(system_prompt, messages):
+    """システムプロンプトと直近の会話から、API に送るメッセージ列を作る"""
+    api_messages = [{"role": "system", "content": system_prompt}]
+    # History Window (Keep last 10 turns to save tokens)
+    for m in messages[-10:]:
+        if m["role"] != "tool":
+             api_messages.append({"role": m["role"], "content": m["content"]})
+    return api_messages
+
+
+def recent_user_history(messages):
+    """直前までのユーザー発言（マルチクエリ検索で追い質問を補うのに使う）"""
+    return [m["content"] for m in messages if m["role"] == "user"][-2:]
+
+
+def prefetch_key(user_input, mode, current_phase, cerebras_model_id, top_k, multi_query):
+    """先読み結果を使ってよいかの判定キー（入力・フェーズ・会話の長さ・設定が全て同じ場合だけ使う）"""
+    return (user_input, mode, current_phase, len(st.session_state.history), cerebras_model_id, top_k, multi_query)
+
+
+def schedule_next_move_prefetch(mode, current_id):
+    """「次へ」「深掘り」の入力で検索（と、有効なら「次へ」の LLM 応答）をバックグラウンドで先行実行する"""
+    prefetcher = get_prefetcher()
+    cerebras_model_id = st.session_state.cerebras_model_id
+    top_k = st.session_state.top_k
+    multi_query = st.session_state.multi_query
+    # 画面の無いスレッドから Streamlit のキャッシュを初期化しないよう、リソースはここで取得しておく
+    model, qdrant_client = get_retrieval_resources()
+    # 回答の反映などでメインスレッドが書き換えるので、会話はコピーして渡す
+    messages = list(st.session_state.history.messages)
+    history = recent_user_history(messages)
+
+    candidates = [(deep_dive_prompt(ANALYSIS_STEPS.get(current_id, "不明")), ANALYSIS_STEPS.get(current_id, "自由分析"), False)]
+    if current_id < 10:
+        next_phase = ANALYSIS_STEPS.get(current_id + 1, "自由分析")
+        candidates.append((next_step_prompt(ANALYSIS_STEPS.get(current_id + 1, "コンプリート")), next_phase, True))
+
+    keys = []
+    for user_input, phase, speculate_llm in candidates:
+        key = prefetch_key(user_input, mode, phase, cerebras_model_id, top_k, multi_query)
+        keys.append(key)
+
+        def retrieve(user_input=user_input, phase=phase):
+            return build_system_prompt(
+                user_input, mode, phase, model, qdrant_client, cerebras_model_id, top_k,
+                multi_query=multi_query, history=history
+            )
+
+        respond = None
+        if speculate_llm and st.session_state.get("speculative_llm"):
+            def respond(system_prompt, priority, user_input=user_input, phase=phase):
+                api_messages = build_api_messages(system_prompt, messages + [{"role": "user", "content": user_input}])
+                return chat_with_cerebras(
+                    api_messages, cerebras_model_id, is_idea_mode=True, notify=None, current_phase=phase,
+                    priority=priority
+                )
+
+        prefetcher.schedule(key, retrieve, respond)
+    prefetcher.retain(keys)
+
+
+def handle_user_input(user_input, mode, cerebras_model_id, top_k, expand_refs=False, multi_query=False,
+                      use_prefetch=False):
+    """use_prefetch=True（Next Move ボタン）の場合、先読み済みの検索・応答があればそれを使う"""
+    current_phase = ANALYSIS_STEPS.get(st.session_state.current_step_id, "自由分析")
+    prefetched = None
+    if "Idea" in mode:
+        prefetcher = get_prefetcher()
+        if use_prefetch:
+            prefetched = prefetcher.take(prefetch_key(user_input, mode, current_phase, cerebras_model_id, top_k, multi_query))
+        # 押されなかった方のボタンの先読みは使われない
+        prefetcher.discard_all()
+
+    history = st.session_state.history
     # Add User Message
-    st.session_state.messages.append({"role": "user", "content": user_input})
+    history.append("user", user_input)
     
     with st.status("🚀 起業家精神を注入中... (Processing)", expanded=True) as status:
-        st.write("🔍 知識ベースを検索中...")
-        # Resources
-        model, qdrant_client = get_retrieval_resources()
-
-        # System Prompt Builder
-        current_phase = ANALYSIS_STEPS.get(st.session_state.current_step_id, "自由分析")
-        system_prompt, results = build_system_prompt(
-            user_input, mode, current_phase, model, qdrant_client, cerebras_model_id, top_k
-        )
+        if prefetched is not None:
+            st.write("⚡ 先読み済みの検索結果を使用")
+            system_prompt, results, response = prefetched
+        else:
+            st.write("🔍 知識ベースを検索中...")
+            response = None
+            # Resources
+            model, qdrant_client = get_retrieval_resources()
+
+            # System Prompt Builder
+            previous_inputs = recent_user_history(history.messages[:-1])
+            law_names = None
+            if "Legal" in mode:
+                # 質問から対象法令を推定し、その法令だけを検索する
+                law_names, _ = route_law_query(user_input)
+                try:
+                    st.write(f"⚖️ {describe_search_space(qdrant_client, LEGAL_COLLECTION_NAME, law_names)}")
+                except Exception:
+                    pass
+            system_prompt, results = build_system_prompt(
+                user_input, mode, current_phase, model, qdrant_client, cerebras_model_id, top_k,
+                expand_refs=expand_refs, law_names=law_names, as_of=st.session_state.get("as_of"),
+                multi_query=multi_query, history=previous_inputs
+            )
         
-        st.write("🧠 AIブレインストーミング中...")
-        # Prepare Messages for API
-        api_messages = [{"role": "system", "content": system_prompt}]
-        # History Window (Keep last 10 turns to save tokens)
-        for m in st.session_state.messages[-10:]:
-            if m["role"] != "tool":
-                 api_messages.append(m)
-
-        # Call Chat Engine
-        response_text, tool_outputs, latency = chat_with_cerebras(
-            api_messages, cerebras_model_id, is_idea_mode=("Idea" in mode)
-        )
+        if response is not None:
+            st.write("⚡ 先読み済みの回答を使用")
+            response_text, tool_outputs, latency = response
+        else:
+            st.write("🧠 AIブレインストーミング中...")
+            # Prepare Messages for API
+            api_messages = build_api_messages(system_prompt, history.messages)
+
+            # Call Chat Engine
+            response_text, tool_outputs, latency = chat_with_cerebras(
+                api_messages, cerebras_model_id, is_idea_mode=("Idea" in mode), current_phase=current_phase
+            )
         
         status.update(label="完了! (Finished)", state="complete", expanded=False)
 
-    # Add Assistant Message
-    st.session_state.messages.append({"role": "assistant", "content": response_text})
+    # Add Assistant Message（検索結果はポイントIDだけを持たせる）
+    collection = IDEA_COLLECTION_NAME if "Idea" in mode else LEGAL_COLLECTION_NAME
+    history.append("assistant", response_text, refs=compact_refs(results, collection))
+    save_step()
     
     # Store Metadata for displaying later (optional, simplistic approach here)
-    st.session_state.last_results = results
     st.session_state.last_tool_outputs = tool_outputs
 
 
+def render_message(msg, mode):
+    if msg["role"] == "tool":
+        return
+    avatar = "👤"
+    if msg["role"] == "assistant":
+        avatar = "😈" if "Idea" in mode else "🧐"
+    with st.chat_message(msg["role"], avatar=avatar):
+        st.markdown(msg["content"])
+
+
+def render_older_messages(history, mode):
+    """直近より前のやり取りを、トグルで開いたときだけページ単位で描画する"""
+    older = history.older_count()
+    if not older:
+        return
+    if not st.toggle(f"🗂️ 過去のやり取りを表示 ({older} 件)", key="show_older"):
+        return
+    pages = (older + HISTORY_PAGE_SIZE - 1) // HISTORY_PAGE_SIZE
+    page = 0
+    if pages > 1:
+        page = st.number_input("ページ (1 = 最新)", min_value=1, max_value=pages, value=1, key="older_page") - 1
+    for msg in history.older_page(page):
+        render_message(msg, mode)
+    st.write("---")
+
+
+def render_refs(refs, mode):
+    """回答に使った検索結果を、ポイントIDから payload を取り直して表示する"""
+    expander_title = "🧠 脳内参照データ (RAG)" if "Idea" in mode else "📚 参照法令・判例"
+    with st.expander(expander_title):
+        try:
+            _, qdrant_client = get_retrieval_resources()
+            payloads = fetch_ref_payloads(qdrant_client, refs)
+        except Exception:
+            payloads = {}
+        for ref in refs["points"]:
+            payload = payloads.get(ref["id"], {})
+            title = payload.get("title") or f"{payload.get('law_name')} {payload.get('article_id')}"
+            if ref.get("referenced_by"):
+                st.markdown(f"- 📎 **{title}** ({ref['referenced_by']} から参照)")
+            else:
+                st.markdown(f"- **{title}** (Relevance: {ref['score']:.3f})")
+            st.caption(payload.get("text", "")[:100] + "...")
+
+
 # --- Main Entry Point ---
 def main():
     st.set_page_config(page_title="StartUp Dojo AI", page_icon="🦄", layout="wide")
@@ -146,10 +352,12 @@ def main():
     init_session_state()
     
     # Sidebar & Settings
-    mode, cerebras_model_id, top_k = render_sidebar()
+    mode, cerebras_model_id, top_k, expand_refs, multi_query = render_sidebar()
     # Store in session for callback access
     st.session_state.cerebras_model_id = cerebras_model_id
     st.session_state.top_k = top_k
+    st.session_state.expand_refs = expand_refs
+    st.session_state.multi_query = multi_query
 
     # Header
     if "Idea" in mode:
@@ -162,15 +370,13 @@ def main():
         input_placeholder = "契約書の条項や懸念点を入力..."
 
     # Display History
-    for msg in st.session_state.messages:
-        if msg["role"] == "tool": continue
-        
-        avatar = "👤"
-        if msg["role"] == "assistant":
-            avatar = "😈" if "Idea" in mode else "🧐"
-        
-        with st.chat_message(msg["role"], avatar=avatar):
-            st.markdown(msg["content"])
+    # 古いやり取りは開いたときだけ、1ページ分を描画する（長いセッションでも再実行のコストが増えない）
+    history = st.session_state.history
+    # 同じ ?session= を開いている別のタブの書き込みを反映する
+    history.sync()
+    render_older_messages(history, mode)
+    for msg in history.recent():
+        render_message(msg, mode)
 
     # Chat Input
     if prompt := st.chat_input(input_placeholder):
@@ -178,24 +384,19 @@ def main():
         with st.chat_message("user", avatar="👤"):
             st.markdown(prompt)
             
-        handle_user_input(prompt, mode, cerebras_model_id, top_k)
+        handle_user_input(prompt, mode, cerebras_model_id, top_k, expand_refs, multi_query)
         st.rerun()
 
     # Render Results (RAG & Tools) for the *last* message if available
-    # Note: This is a simple way to show context. A more robust way is to attach context to message history objects.
-    if hasattr(st.session_state, 'last_results') and st.session_state.last_results:
-        expander_title = "🧠 脳内参照データ (RAG)" if "Idea" in mode else "📚 参照法令・判例"
-        with st.expander(expander_title):
-            for res in st.session_state.last_results:
-                payload = res.payload
-                title = payload.get("title") or f"{payload.get('law_name')} {payload.get('article_id')}"
-                st.markdown(f"- **{title}** (Relevance: {res.score:.3f})")
-                st.caption(payload.get("text", "")[:100] + "...")
-            # Clear to avoid showing on refresh without new input (Optional)
-            # st.session_state.last_results = None 
+    last = history.messages[-1] if history.messages else None
+    if last and last.get("refs"):
+        render_refs(last["refs"], mode)
 
     # Next Actions
     render_next_move_buttons(mode)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    # 無効なときはプロファイラを一切動かさない（nullcontext）
+    profile_label = st.session_state.history.session_id[:8] if "history" in st.session_state else "new"
+    with maybe_profile(should_profile(st.session_state.get("profile_session", False)), profile_label):
+        main()
\ No newline at end of file
@@ -0,0 +1,176 @@
+"""
+Cerebras の chat completions を真似るローカルのモックサーバー（レート制限・リトライの検証用）。
+
+    # サーバーだけ起動して、アプリを向ける
+    python mock_cerebras.py --port 8088 --limit-per-sec 3
+    CEREBRAS_BASE_URL=http://localhost:8088 streamlit run main.py
+
+    # サーバーを起動し、llm_scheduler 経由で同時にリクエストを投げてメトリクスを表示する
+    python mock_cerebras.py --bench 40 --limit-per-sec 3 --error-rate 0.1
+"""
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class MockState:
+    """サーバー側のレート制限（トークンバケット）と、エラー・遅延の設定"""
+
+    def __init__(self, limit_per_sec, error_rate, latency_sec, tokens_per_sec):
+        self.limit_per_sec = limit_per_sec
+        self.error_rate = error_rate
+        self.latency_sec = latency_sec
+        self.tokens_per_sec = tokens_per_sec
+        self.tokens = float(max(1, limit_per_sec))
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+        self.counts = {"ok": 0, "429": 0, "503": 0}
+
+    def allow(self):
+        if self.limit_per_sec <= 0:
+            return True
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(max(1, self.limit_per_sec), self.tokens + (now - self.last) * self.limit_per_sec)
+            self.last = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+    def count(self, key):
+        with self.lock:
+            self.counts[key] += 1
+
+
+def make_handler(state):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status, body, headers=None):
+            data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            request = json.loads(self.rfile.read(length) or b"{}")
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self._send(404, {"message": f"unknown path {self.path}"})
+                return
+
+            if not state.allow():
+                state.count("429")
+                self._send(429, {"message": "Too many requests", "type": "too_many_requests_error"},
+                           {"Retry-After": f"{1 / state.limit_per_sec:.2f}"})
+                return
+            if random.random() < state.error_rate:
+                state.count("503")
+                self._send(503, {"message": "Service unavailable", "type": "server_error"})
+                return
+
+            completion_tokens = random.randint(100, 400)
+            completion_time = completion_tokens / state.tokens_per_sec
+            time.sleep(state.latency_sec + completion_time)
+            state.count("ok")
+            last_user = next(
+                (m.get("content") for m in reversed(request.get("messages", [])) if m.get("role") == "user"), ""
+            )
+            self._send(200, {
+                "id": f"chatcmpl-mock-{random.getrandbits(32):08x}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request.get("model"),
+                "choices": [{
+                    "index": 0,
+                    "finish_reason": "stop",
+                    "message": {"role": "assistant", "content": f"(mock) {str(last_user)[:50]}"},
+                }],
+                "usage": {"prompt_tokens": 100, "completion_tokens": completion_tokens,
+                          "total_tokens": 100 + completion_tokens},
+                "time_info": {"queue_time": 0.0, "prompt_time": state.latency_sec,
+                              "completion_time": completion_time,
+                              "total_time": state.latency_sec + completion_time, "created": time.time()},
+            })
+
+    return Handler
+
+
+def start_server(port, state):
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(state))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def bench(port, num_requests, speculative_ratio):
+    """モックに対して llm_scheduler 経由で同時にリクエストを投げ、優先度ごとの待ち時間とメトリクスを表示する"""
+    from cerebras.cloud.sdk import Cerebras
+
+    from backend.llm_scheduler import PRIORITY_INTERACTIVE, PRIORITY_SPECULATIVE, RequestScheduler
+
+    client = Cerebras(api_key="mock", base_url=f"http://127.0.0.1:{port}", max_retries=0)
+    scheduler = RequestScheduler()
+    results = {PRIORITY_INTERACTIVE: [], PRIORITY_SPECULATIVE: []}
+    errors = []
+
+    def worker(i):
+        priority = PRIORITY_SPECULATIVE if random.random() < speculative_ratio else PRIORITY_INTERACTIVE
+        start = time.time()
+        try:
+            scheduler.run(lambda: client.chat.completions.create(
+                model="llama-3.3-70b", messages=[{"role": "user", "content": f"request {i}"}]
+            ), priority)
+            results[priority].append(time.time() - start)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(num_requests)]
+    start = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    print(f"{num_requests} requests in {time.time() - start:.1f}s")
+    for priority, label in ((PRIORITY_INTERACTIVE, "interactive"), (PRIORITY_SPECULATIVE, "speculative")):
+        times = sorted(results[priority])
+        if times:
+            print(f"  {label}: {len(times)} 件, 平均 {sum(times) / len(times):.2f}s, 最大 {times[-1]:.2f}s")
+    print(f"  失敗: {len(errors)} 件")
+    print(f"  {scheduler.describe()}")
+    print(f"  最大待ち行列: {scheduler.snapshot()['max_queue_depth']}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Cerebras API のモックサーバー")
+    parser.add_argument("--port", type=int, default=8088)
+    parser.add_argument("--limit-per-sec", type=float, default=3, help="これを超えると 429 を返す（0 で無制限）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="503 を返す確率")
+    parser.add_argument("--latency", type=float, default=0.2, help="TTFT に相当する遅延（秒）")
+    parser.add_argument("--tokens-per-sec", type=float, default=2000)
+    parser.add_argument("--bench", type=int, default=0, help="指定した数のリクエストを同時に投げて終了する")
+    parser.add_argument("--speculative-ratio", type=float, default=0.5, help="bench で先読み扱いにする割合")
+    args = parser.parse_args()
+
+    state = MockState(args.limit_per_sec, args.error_rate, args.latency, args.tokens_per_sec)
+    server = start_server(args.port, state)
+    if args.bench:
+        bench(args.port, args.bench, args.speculative_ratio)
+        print(f"  サーバー側: {state.counts}")
+        server.shutdown()
+    else:
+        print(f"Mock Cerebras listening on http://127.0.0.1:{args.port} ({state.limit_per_sec} req/s)")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            server.shutdown()
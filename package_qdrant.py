@@ -0,0 +1,302 @@
+import json
+import os
+import subprocess
+import time
+import urllib.request
+
+from qdrant_client import QdrantClient
+from qdrant_client.http import models
+
+from backend.qdrant_store import alias_target, list_versions
+from config import IDEA_COLLECTION_NAME, LEGAL_COLLECTION_NAME, QDRANT_PATH, QDRANT_URL
+
+# --- 設定 ---
+PACKAGE_DIR = "qdrant_package"               # スナップショットとレポートの出力先
+REPORT_FILE = "report.json"
+# アプリが読むコレクション（エイリアス名）。これらが指す実体以外は「使われていない」とみなす
+APP_COLLECTIONS = [LEGAL_COLLECTION_NAME, IDEA_COLLECTION_NAME]
+# マージ後に目指すセグメント数（default_segment_number）
+TARGET_SEGMENTS = 1
+# セグメントのマージを待つ上限
+OPTIMIZE_TIMEOUT_SEC = 600
+OPTIMIZE_POLL_SEC = 2
+# 起動時間の計測で Qdrant サーバーを起動し直すコマンド（空文字なら起動し直さず、動いているサーバーで測る）
+RESTART_CMD = "docker compose restart qdrant"
+# 起動し直した後、/readyz が通るまで待つ上限
+READY_TIMEOUT_SEC = 600
+READY_POLL_SEC = 0.2
+
+
+def storage_size(path):
+    """ディレクトリ以下のファイルサイズの合計（バイト）"""
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            file_path = os.path.join(dirpath, filename)
+            if not os.path.islink(file_path):
+                total += os.path.getsize(file_path)
+    return total
+
+
+def resident_memory_bytes(url):
+    """Qdrant サーバーの /metrics から常駐メモリ（memory_resident_bytes）を読む。取れなければ None"""
+    try:
+        with urllib.request.urlopen(f"{url.rstrip('/')}/metrics", timeout=5) as resp:
+            for line in resp.read().decode("utf-8").splitlines():
+                if line.startswith("memory_resident_bytes"):
+                    return int(float(line.split()[-1]))
+    except Exception:
+        return None
+    return None
+
+
+def resolve_collections(client):
+    """アプリが読む名前 → 実体のコレクション名（エイリアスならその先、実コレクションならそのまま）"""
+    existing = {c.name for c in client.get_collections().collections}
+    resolved = {}
+    for name in APP_COLLECTIONS:
+        target = alias_target(client, name)
+        if target is None and name in existing:
+            target = name
+        if target is not None:
+            resolved[name] = target
+    return resolved
+
+
+def wait_ready(url, timeout=READY_TIMEOUT_SEC):
+    """/readyz が 200 を返す（全シャードの読み込みが終わる）まで待つ"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen(f"{url.rstrip('/')}/readyz", timeout=5) as resp:
+                if resp.status == 200:
+                    return
+        except Exception:
+            pass
+        time.sleep(READY_POLL_SEC)
+    raise RuntimeError(f"{url} が {timeout} 秒以内に ready になりませんでした。")
+
+
+def restart_server(url, restart_cmd):
+    """
+    restart_cmd でサーバーを起動し直し、/readyz が通るまでの秒数。
+    コマンドを実行した時点から測るので停止の時間も含まれるが、before / after で同じようにかかる。
+    """
+    start = time.time()
+    subprocess.run(restart_cmd, shell=True, check=True)
+    wait_ready(url)
+    return time.time() - start
+
+
+def measure_open(url, collections):
+    """
+    新しいクライアントで接続し、各コレクションに1回検索が通るまでの秒数。
+    起動し直した直後に測ると、ready になった後に遅れて読まれる分（メモリマップしたファイルのページインなど）が含まれる。
+    """
+    start = time.time()
+    client = QdrantClient(url=url)
+    for name in collections:
+        info = client.get_collection(name)
+        size = info.config.params.vectors.size
+        client.query_points(collection_name=name, query=[1.0] * size, limit=1)
+    return time.time() - start
+
+
+def measure(url, storage_dir, collections, restart_cmd=RESTART_CMD):
+    """
+    restart_cmd があればサーバーを起動し直し、起動（/readyz まで）と初回検索の時間を測る。
+    その後のディスク使用量・RSS・コレクション数・セグメント数も返す。
+    """
+    collections = list(collections)
+    ready_sec = restart_server(url, restart_cmd) if restart_cmd else None
+    open_sec = measure_open(url, collections)
+    client = QdrantClient(url=url)
+    segments = {name: client.get_collection(name).segments_count for name in collections}
+    return {
+        "ready_sec": ready_sec,
+        "open_sec": open_sec,
+        "cold_start_sec": ready_sec + open_sec if ready_sec is not None else None,
+        "disk_bytes": storage_size(storage_dir) if storage_dir and os.path.isdir(storage_dir) else None,
+        "rss_bytes": resident_memory_bytes(url),
+        "collections": len(client.get_collections().collections),
+        "segments": segments,
+    }
+
+
+def drop_unused(client, keep, dry_run=False, drop_versions=False):
+    """
+    keep 以外のコレクション（legal_rag_v2 など）を削除する。
+    upsert_legal.py / upsert_ideas.py が --rollback 用に残している旧バージョン（{エイリアス}__v{日時}）は、
+    drop_versions=True のときだけ削除する。
+    """
+    versions = set()
+    for alias in APP_COLLECTIONS:
+        versions.update(list_versions(client, alias))
+
+    dropped = []
+    for c in client.get_collections().collections:
+        if c.name in keep:
+            continue
+        if c.name in versions and not drop_versions:
+            print(f"  残す（ロールバック用の旧バージョン）: {c.name}")
+            continue
+        dropped.append(c.name)
+        if dry_run:
+            print(f"  [dry-run] 削除対象: {c.name}")
+        else:
+            client.delete_collection(collection_name=c.name)
+            print(f"  削除: {c.name}")
+    return dropped
+
+
+def compact_collection(client, name):
+    """
+    読み取り専用向けに設定を変え、最適化（セグメントのマージ）が終わるまで待つ。
+    - セグメントを TARGET_SEGMENTS 個にまとめる（default_segment_number）
+    - ベクトル・HNSW インデックス・payload をディスク上に置き、メモリマップで読む
+    """
+    client.update_collection(
+        collection_name=name,
+        optimizers_config=models.OptimizersConfigDiff(default_segment_number=TARGET_SEGMENTS),
+        vectors_config={"": models.VectorParamsDiff(on_disk=True)},
+        hnsw_config=models.HnswConfigDiff(on_disk=True),
+        collection_params=models.CollectionParamsDiff(on_disk_payload=True),
+    )
+    # update_collection の直後は最適化が始まる前で GREEN のことがあるので、セグメント数が減るまで待つ
+    deadline = time.time() + OPTIMIZE_TIMEOUT_SEC
+    while time.time() < deadline:
+        info = client.get_collection(name)
+        if info.status == models.CollectionStatus.GREEN and info.segments_count <= TARGET_SEGMENTS:
+            return info.segments_count
+        time.sleep(OPTIMIZE_POLL_SEC)
+    segments = client.get_collection(name).segments_count
+    print(f"  警告: {name} のマージが {OPTIMIZE_TIMEOUT_SEC} 秒で終わりませんでした（{segments} segments）。")
+    return segments
+
+
+def snapshot_collection(client, url, name, app_name, out_dir):
+    """
+    コレクションのスナップショットを作ってダウンロードし、{アプリが読む名前}.snapshot として保存する。
+    サーバー側のスナップショットはダウンロード後に削除する。
+    """
+    snapshot = client.create_snapshot(collection_name=name, wait=True)
+    path = os.path.join(out_dir, f"{app_name}.snapshot")
+    download_url = f"{url.rstrip('/')}/collections/{name}/snapshots/{snapshot.name}"
+    with urllib.request.urlopen(download_url) as resp, open(path, "wb") as f:
+        while True:
+            block = resp.read(1 << 20)
+            if not block:
+                break
+            f.write(block)
+    client.delete_snapshot(collection_name=name, snapshot_name=snapshot.name)
+    return path
+
+
+def format_bytes(value):
+    return "-" if value is None else f"{value / 1e6:.1f} MB"
+
+
+def format_sec(value):
+    return "-" if value is None else f"{value:.2f}s"
+
+
+def print_report(before, after):
+    print("\n=== Report ===")
+    rows = [
+        ("起動 (/readyz まで)", format_sec(before.get("ready_sec")), format_sec(after.get("ready_sec"))),
+        ("初回検索", format_sec(before["open_sec"]), format_sec(after["open_sec"])),
+        ("起動+初回検索", format_sec(before.get("cold_start_sec")), format_sec(after.get("cold_start_sec"))),
+        ("disk", format_bytes(before["disk_bytes"]), format_bytes(after["disk_bytes"])),
+        ("RSS (qdrant)", format_bytes(before["rss_bytes"]), format_bytes(after["rss_bytes"])),
+        ("collections", str(before["collections"]), str(after["collections"])),
+        ("segments", str(sum(before["segments"].values())), str(sum(after["segments"].values()))),
+    ]
+    for label, b, a in rows:
+        print(f"  {label:<22} {b:>10} → {a:>10}")
+    if before.get("ready_sec") is None or after.get("ready_sec") is None:
+        print("  （起動し直さずに測った値があります。起動時の読み込みは --restart-cmd で起動し直して測ります）")
+
+
+def package(storage_dir=QDRANT_PATH, out_dir=PACKAGE_DIR, dry_run=False, drop_versions=False,
+            restart_cmd=RESTART_CMD):
+    if not QDRANT_URL:
+        # 同梱の qdrant_storage/ はサーバー形式で、ローカルモード（QdrantClient(path=...)）では読めない
+        print("QDRANT_URL を設定し、qdrant_storage/ をマウントした Qdrant サーバーに対して実行してください。")
+        return
+
+    client = QdrantClient(url=QDRANT_URL)
+    resolved = resolve_collections(client)
+    if not resolved:
+        print(f"アプリが読むコレクション（{', '.join(APP_COLLECTIONS)}）が見つかりません。")
+        return
+    for app_name, target in resolved.items():
+        print(f"{app_name} → {target}")
+
+    if dry_run:
+        drop_unused(client, set(resolved.values()), dry_run, drop_versions)
+        return
+
+    # 元のレイアウトのまま起動し直して測る
+    before = measure(QDRANT_URL, storage_dir, resolved.values(), restart_cmd)
+    client = QdrantClient(url=QDRANT_URL)
+
+    # 1. 使われていないコレクションを削除
+    drop_unused(client, set(resolved.values()), dry_run, drop_versions)
+
+    # 2. セグメントをマージし、ディスク上のメモリマップ読み込みに切り替える
+    for target in resolved.values():
+        segments = compact_collection(client, target)
+        print(f"  {target}: {before['segments'][target]} → {segments} segments")
+
+    # 3. スナップショット（アプリが読む名前で復元できるように保存する）
+    os.makedirs(out_dir, exist_ok=True)
+    for app_name, target in resolved.items():
+        path = snapshot_collection(client, QDRANT_URL, target, app_name, out_dir)
+        print(f"  snapshot: {path} ({format_bytes(os.path.getsize(path))})")
+
+    # まとめ直したストレージで起動し直して測る
+    after = measure(QDRANT_URL, storage_dir, resolved.values(), restart_cmd)
+    print_report(before, after)
+    with open(os.path.join(out_dir, REPORT_FILE), "w", encoding="utf-8") as f:
+        json.dump({"before": before, "after": after}, f, ensure_ascii=False, indent=2)
+
+
+def report_only(storage_dir=QDRANT_PATH, out_dir=PACKAGE_DIR, restart_cmd=RESTART_CMD):
+    """
+    QDRANT_URL のサーバーを restart_cmd で起動し直して測り、package 時の before と比べる。
+    スナップショットから起動するサーバー（docker-compose.yml の qdrant-packaged）を指せば、復元を含めた起動時間と比べられる。
+    """
+    if not QDRANT_URL:
+        print("QDRANT_URL を設定してください。")
+        return
+    client = QdrantClient(url=QDRANT_URL)
+    current = measure(QDRANT_URL, storage_dir, resolve_collections(client).values(), restart_cmd)
+    path = os.path.join(out_dir, REPORT_FILE)
+    if not os.path.exists(path):
+        print(json.dumps(current, ensure_ascii=False, indent=2))
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        saved = json.load(f)
+    print_report(saved["before"], current)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="qdrant_storage を読み取り専用向けにまとめ、起動時にメモリマップできるスナップショットを作る"
+    )
+    parser.add_argument("--storage-dir", default=QDRANT_PATH, help="サーバーがマウントしているストレージ（ディスク使用量の計測用）")
+    parser.add_argument("--out", default=PACKAGE_DIR, help="スナップショットとレポートの出力先")
+    parser.add_argument("--dry-run", action="store_true", help="削除対象のコレクションを表示するだけ")
+    parser.add_argument("--drop-versions", action="store_true",
+                        help="--rollback 用に残している旧バージョン（__v{日時}）も削除する")
+    parser.add_argument("--report", action="store_true", help="パッケージ化せずに計測だけ行い、前回の before と比べる")
+    parser.add_argument("--restart-cmd", default=RESTART_CMD,
+                        help="起動時間の計測でサーバーを起動し直すコマンド（空文字なら起動し直さない）")
+    args = parser.parse_args()
+
+    if args.report:
+        report_only(args.storage_dir, args.out, args.restart_cmd)
+    else:
+        package(args.storage_dir, args.out, args.dry_run, args.drop_versions, args.restart_cmd)
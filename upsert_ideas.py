@@ -0,0 +1,225 @@
+import os
+import re
+
+import numpy as np
+
+from backend.idea_index import (
+    COMMON_STEP_ID,
+    COMMON_STEP_NAME,
+    PAYLOAD_INDEXES,
+    build_phase_filter,
+    point_id,
+)
+from backend.qdrant_store import (
+    connect_qdrant,
+    create_shadow_collection,
+    publish_collection,
+    rollback,
+)
+from config import ANALYSIS_STEPS, IDEA_COLLECTION_NAME
+from embedding import encode_bucketed
+from upsert_legal import ENCODE_MEMORY_BUDGET_MB, load_embedding_model
+
+# --- 設定 ---
+FRAMEWORK_DIR = "frameworks"                 # フレームワーク資料（Markdown / テキスト）を置くディレクトリ
+COLLECTION_NAME = IDEA_COLLECTION_NAME       # アプリが読むエイリアス名（実体は idea_frameworks__v{日時}）
+FRAMEWORK_EXTENSIONS = (".md", ".markdown", ".txt")
+# 1チャンクの最大文字数（見出しごとに切り、長い節は段落の切れ目でこの長さまでに分ける）
+MAX_CHUNK_CHARS = 800
+# 何チャンクごとにベクトル化して Qdrant に送るか（資料全体をメモリに載せない）
+EMBED_BATCH_CHUNKS = 256
+
+HEADING_RE = re.compile(r"^(#{1,6})\s+(.*?)\s*#*\s*$")
+STEP_NUMBER_RE = re.compile(r"^(\d{1,2})(?:[_\-\s.]|$)")
+
+
+def detect_step(rel_path):
+    """
+    資料のパスからフェーズを推定する。
+    - ファイル名・ディレクトリ名の先頭の番号（"03_lean.md", "3/..."）
+    - パスに含まれるフェーズ名（"リーンキャンバス/" など。より長い名前を優先するので「再リーンキャンバス」と区別できる）
+    どちらでもなければ共通資料（全フェーズの検索対象）にする。
+    """
+    parts = rel_path.replace(os.sep, "/").split("/")
+    for part in parts:
+        match = STEP_NUMBER_RE.match(part)
+        if match and int(match.group(1)) in ANALYSIS_STEPS:
+            return int(match.group(1))
+    for step_id, step_name in sorted(ANALYSIS_STEPS.items(), key=lambda s: len(s[1]), reverse=True):
+        if step_name in rel_path:
+            return step_id
+    return COMMON_STEP_ID
+
+
+def iter_framework_files(root):
+    """root 以下の資料ファイルを (相対パス, 絶対パス) でパス順に返す"""
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if filename.lower().endswith(FRAMEWORK_EXTENSIONS):
+                path = os.path.join(dirpath, filename)
+                yield os.path.relpath(path, root), path
+
+
+def iter_file_chunks(path, max_chars=MAX_CHUNK_CHARS):
+    """
+    資料1ファイルを1行ずつ読み、(見出しのパス, 本文) のチャンクを順に返す（ファイル全体を読み込まない）。
+    Markdown の見出しで区切り、max_chars を超える節は段落（空行）の切れ目で分ける。
+    段落1つが max_chars を超える場合はそのまま1チャンクにする。
+    """
+    headings = []
+    paragraphs = []
+    lines = []
+    size = 0
+
+    with open(path, "r", encoding="utf-8") as f:
+        for raw in f:
+            line = raw.rstrip("\n")
+            heading = HEADING_RE.match(line)
+            if not heading and line.strip():
+                lines.append(line)
+                continue
+
+            # 段落の終わり（空行・見出し）
+            if lines:
+                paragraph = "\n".join(lines).strip()
+                lines = []
+                if paragraphs and size + len(paragraph) > max_chars:
+                    yield " > ".join(headings), "\n\n".join(paragraphs)
+                    paragraphs, size = [], 0
+                paragraphs.append(paragraph)
+                size += len(paragraph)
+
+            if heading:
+                if paragraphs:
+                    yield " > ".join(headings), "\n\n".join(paragraphs)
+                    paragraphs, size = [], 0
+                level = len(heading.group(1))
+                del headings[level - 1:]
+                headings.append(heading.group(2))
+
+    if lines:
+        paragraph = "\n".join(lines).strip()
+        if paragraphs and size + len(paragraph) > max_chars:
+            yield " > ".join(headings), "\n\n".join(paragraphs)
+            paragraphs = []
+        paragraphs.append(paragraph)
+    if paragraphs:
+        yield " > ".join(headings), "\n\n".join(paragraphs)
+
+
+def iter_framework_chunks(root, step_override=None, max_chars=MAX_CHUNK_CHARS):
+    """root 以下の全資料をチャンクの dict（payload になる）として順に返す"""
+    for rel_path, path in iter_framework_files(root):
+        step_id = step_override if step_override is not None else detect_step(rel_path)
+        step_name = ANALYSIS_STEPS.get(step_id, COMMON_STEP_NAME)
+        doc_title = os.path.splitext(os.path.basename(rel_path))[0]
+        for index, (heading, text) in enumerate(iter_file_chunks(path, max_chars)):
+            chunk_id = f"{rel_path}#{index}"
+            yield {
+                "chunk_id": chunk_id,
+                "title": f"{step_name} / {heading or doc_title}",
+                "text": text,
+                "step_id": step_id,
+                "step_name": step_name,
+                "source": rel_path,
+                "chunk_index": index,
+            }
+
+
+def format_for_embedding(chunk):
+    """
+    EmbeddingGemma のドキュメント側フォーマット "title: {Title} | text: {Body}"。
+    検索側の "task: search framework | query: ..." と対になる。
+    """
+    return f"title: {chunk['title']} | text: {chunk['text']}"
+
+
+def iter_batches(chunks, size=EMBED_BATCH_CHUNKS):
+    batch = []
+    for chunk in chunks:
+        batch.append(chunk)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def describe_chunks(root, step_override=None):
+    """ベクトル化せずに、フェーズごとのチャンク数と文字数を表示する（資料の置き方の確認用）"""
+    counts = {}
+    for chunk in iter_framework_chunks(root, step_override):
+        count, chars = counts.get(chunk["step_name"], (0, 0))
+        counts[chunk["step_name"]] = (count + 1, chars + len(chunk["text"]))
+    if not counts:
+        print(f"'{root}' に資料（{', '.join(FRAMEWORK_EXTENSIONS)}）がありません。")
+    for step_name, (count, chars) in counts.items():
+        print(f"  {step_name}: {count} chunks, {chars} chars")
+
+
+def upsert_frameworks(root=FRAMEWORK_DIR, step_override=None):
+    if not os.path.isdir(root):
+        print(f"ディレクトリ '{root}' が見つかりません。")
+        return
+
+    # 1. モデルの読み込み
+    model, _ = load_embedding_model()
+
+    # 2. シャドウコレクションを作成（稼働中のコレクションには触らない）
+    client = connect_qdrant()
+    # フェーズで絞り込めるように payload index も作成
+    collection = create_shadow_collection(
+        client, COLLECTION_NAME, model.get_sentence_embedding_dimension(), PAYLOAD_INDEXES
+    )
+
+    # 3. チャンク化 → ベクトル化 → 登録を EMBED_BATCH_CHUNKS 件ずつ流す
+    total = 0
+    probe = None
+    for batch in iter_batches(iter_framework_chunks(root, step_override)):
+        vectors = encode_bucketed(
+            model,
+            [format_for_embedding(chunk) for chunk in batch],
+            memory_budget_mb=ENCODE_MEMORY_BUDGET_MB,
+        )
+        client.upload_collection(
+            collection_name=collection,
+            vectors=vectors,
+            payload=batch,
+            ids=[point_id(chunk["chunk_id"]) for chunk in batch],
+            batch_size=EMBED_BATCH_CHUNKS,
+            wait=True,
+        )
+        if probe is None:
+            probe = (np.asarray(vectors[0], dtype=np.float32), batch[0]["step_name"])
+        total += len(batch)
+        print(f"  {total} chunks uploaded")
+
+    if probe is None:
+        print(f"'{root}' に登録できる資料がありません。")
+        client.delete_collection(collection_name=collection)
+        return
+
+    # 4. 検証してからエイリアスを切り替える（フェーズの絞り込みが効くことも確認する）
+    publish_collection(client, COLLECTION_NAME, collection, total, probe[0], build_phase_filter(probe[1]))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="フレームワーク資料をフェーズ付きでベクトル化して Qdrant に登録する")
+    parser.add_argument("--dir", default=FRAMEWORK_DIR, help="資料のディレクトリ（Markdown / テキスト）")
+    parser.add_argument(
+        "--step", type=int, choices=sorted(ANALYSIS_STEPS),
+        help="全資料をこのフェーズとして登録する（省略時はファイル名・ディレクトリ名から推定）"
+    )
+    parser.add_argument("--dry-run", action="store_true", help="ベクトル化せずにフェーズごとのチャンク数だけ表示する")
+    parser.add_argument("--rollback", action="store_true", help="エイリアスを1つ前のバージョンに戻す")
+    args = parser.parse_args()
+
+    if args.rollback:
+        rollback(connect_qdrant(), COLLECTION_NAME)
+    elif args.dry_run:
+        describe_chunks(args.dir, args.step)
+    else:
+        upsert_frameworks(args.dir, args.step)
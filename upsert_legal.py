@@ -1,22 +1,74 @@
-import json
 import os
 
+import numpy as np
 import torch
 from dotenv import load_dotenv
 from huggingface_hub import login
-from qdrant_client import QdrantClient
-from qdrant_client.http import models
 from sentence_transformers import SentenceTransformer
 
+from artifacts import (
+    ARTIFACT_DIR,
+    is_artifact_fresh,
+    load_chunks,
+    load_json_chunks,
+    load_vectors,
+    save_chunks,
+    save_vectors,
+    texts_fingerprint,
+)
+from backend.legal_index import PAYLOAD_INDEXES, record_point_id
+from backend.qdrant_store import (
+    connect_qdrant,
+    create_shadow_collection,
+    publish_collection,
+    rollback,
+)
+from embedding import DEFAULT_MEMORY_BUDGET_MB, encode_bucketed
+
 # --- 設定 ---
 CHUNK_DIR = "chunk"                          # 全ての JSON が入っているディレクトリ
-COLLECTION_NAME = "legal_rag_gemma"          # コレクション名を変更
+COLLECTION_NAME = "legal_rag_gemma"          # アプリが読むエイリアス名（実体は legal_rag_gemma__v{日時}）
 MODEL_ID = "google/embeddinggemma-300m"      # Googleの軽量モデル
+# CPU マシンで全法令を取り込むときは ENCODE_WORKERS を増やすとコアを使い切れる（プロセスごとにモデルを持つ）
+ENCODE_WORKERS = int(os.getenv("ENCODE_WORKERS", "1"))
+ENCODE_MEMORY_BUDGET_MB = int(os.getenv("ENCODE_MEMORY_BUDGET_MB", str(DEFAULT_MEMORY_BUDGET_MB)))
 
 # .env から環境変数を読み込む
 load_dotenv()
 
-def upsert_gemma():
+def load_legal_chunks():
+    """
+    チャンクを読み込む。アーティファクト（SQLite）が chunk/*.json より新しければそちらを使い、
+    古い・無い場合は JSON から読み込んでアーティファクトを作り直す。
+    """
+    if is_artifact_fresh(CHUNK_DIR, ARTIFACT_DIR):
+        print(f"Loading chunks from {ARTIFACT_DIR} ...")
+        return load_chunks(ARTIFACT_DIR)
+
+    if not os.path.isdir(CHUNK_DIR):
+        print(f"ディレクトリ '{CHUNK_DIR}' が見つかりません。")
+        return []
+
+    print(f"Loading chunks from {CHUNK_DIR} (JSON) ...")
+    chunks = load_json_chunks(CHUNK_DIR)
+    if chunks:
+        save_chunks(chunks, ARTIFACT_DIR)
+    return chunks
+
+
+def format_for_embedding(chunk):
+    """
+    EmbeddingGemma用フォーマット変換
+    推奨フォーマット: "title: {Title} | text: {Body}"
+    """
+    # タイトルとして「法令名 + 条数 + 見出し（+ 項・号）」を設定
+    title_part = chunk.get("title") or f"{chunk['law_name']} {chunk['article_id']} {chunk['caption'] or ''}".strip()
+    # titleが空の場合は "title: none | text: ..." とする仕様ですが、今回は必ず入る想定
+    return f"title: {title_part} | text: {chunk['text']}"
+
+
+def load_embedding_model():
+    """Embedding モデルを読み込み、(model, device) を返す（upsert_ideas.py からも使う）"""
     # 1. デバイス設定
     device = "cuda" if torch.cuda.is_available() else "cpu"
     print(f"Using device: {device}")
@@ -33,97 +85,90 @@ def upsert_gemma():
     # trust_remote_code=True は念のため付けておきます
     print(f"Loading model: {MODEL_ID} ...")
     model = SentenceTransformer(MODEL_ID, device=device, trust_remote_code=True)
+    return model, device
 
-    # 3. データの読み込み（chunk/ 配下の全 JSON を一括読み込み）
-    if not os.path.isdir(CHUNK_DIR):
-        print(f"ディレクトリ '{CHUNK_DIR}' が見つかりません。")
-        return
 
-    json_files = sorted(
-        f for f in os.listdir(CHUNK_DIR)
-        if f.endswith(".json")
+def embed_texts(formatted_texts):
+    model, device = load_embedding_model()
+
+    print("Starting embedding...")
+    # トークン長の近いチャンク同士でバッチを組み、バッチサイズはメモリ予算から決める（出力は元の順序）
+    workers = ENCODE_WORKERS if device == "cpu" else 1
+    return encode_bucketed(
+        model,
+        formatted_texts,
+        memory_budget_mb=ENCODE_MEMORY_BUDGET_MB,
+        num_workers=workers,
+        model_id=MODEL_ID,
     )
 
-    if not json_files:
-        print(f"'{CHUNK_DIR}' に JSON ファイルがありません。")
-        return
 
-    chunks = []
-    print(f"Loading chunks from {CHUNK_DIR}: {', '.join(json_files)}")
-    for filename in json_files:
-        path = os.path.join(CHUNK_DIR, filename)
-        try:
-            with open(path, "r", encoding="utf-8") as f:
-                data = json.load(f)
-            if isinstance(data, list):
-                chunks.extend(data)
-            else:
-                print(f"警告: {path} の形式がリストではありません。スキップします。")
-        except FileNotFoundError:
-            print(f"警告: {path} が見つかりません。スキップします。")
-        except json.JSONDecodeError as e:
-            print(f"警告: {path} の JSON パースに失敗しました: {e}")
+def chunk_payload(chunk):
+    # 検索用の combined_text 以外はすべて payload に載せる
+    # （parent_id / level / searchable は親展開に使う）
+    payload = {k: v for k, v in chunk.items() if k != "combined_text"}
+    payload["chunk_id"] = chunk.get("chunk_id") or f"{chunk.get('law_name')}|{chunk.get('article_id')}"
+    payload.setdefault("searchable", True)
+    return payload
+
 
+def upsert_gemma():
+    # 1. データの読み込み（アーティファクト or chunk/ 配下の全 JSON）
+    chunks = load_legal_chunks()
     if not chunks:
         print("読み込める Chunk データがありません。")
         return
 
-    # 4. EmbeddingGemma用フォーマット変換
-    # 推奨フォーマット: "title: {Title} | text: {Body}"
-    print("Formatting texts for EmbeddingGemma...")
-    formatted_texts = []
-    for chunk in chunks:
-        # タイトルとして「法令名 + 条数 + 見出し」を設定
-        title_part = f"{chunk['law_name']} {chunk['article_id']} {chunk['caption'] or ''}".strip()
-        # 本文
-        text_part = chunk['text']
-        
-        # フォーマット適用
-        # titleが空の場合は "title: none | text: ..." とする仕様ですが、今回は必ず入る想定
-        ft = f"title: {title_part} | text: {text_part}"
-        formatted_texts.append(ft)
-
-    # 5. ベクトル化 (Embedding)
-    print("Starting embedding...")
-    embeddings = model.encode(
-        formatted_texts,
-        batch_size=32,       # モデルが軽いのでバッチサイズを上げられます（8 -> 32）
-        show_progress_bar=True,
-        normalize_embeddings=True
-    )
+    # 2. ベクトル化 (Embedding)
+    # 同じモデル・同じ入力テキストのベクトルがアーティファクトにあれば、メモリマップして再利用する
+    formatted_texts = [format_for_embedding(chunk) for chunk in chunks]
+    fingerprint = texts_fingerprint(formatted_texts)
+    embeddings = load_vectors(ARTIFACT_DIR, model_id=MODEL_ID, fingerprint=fingerprint)
+    if embeddings is None:
+        embeddings = embed_texts(formatted_texts)
+        save_vectors(embeddings, ARTIFACT_DIR, model_id=MODEL_ID, fingerprint=fingerprint)
+        # 以降はディスク上の .npy をメモリマップして使う（float32 の行列を抱えたままにしない）
+        embeddings = load_vectors(ARTIFACT_DIR)
+    else:
+        print(f"Reusing vectors from {ARTIFACT_DIR} (memory-mapped)")
+
+    # 3. Qdrantへの登録
+    # 稼働中のコレクションには触らず、新しいシャドウコレクションに作ってからエイリアスを付け替える
+    client = connect_qdrant()
 
-    # 6. Qdrantへの登録
-    # client = QdrantClient("localhost", port=6333)
-    client = QdrantClient(path="./qdrant_storage")
-    
     # EmbeddingGemmaの次元数は 768 です
-    vector_size = embeddings.shape[1] 
+    vector_size = embeddings.shape[1]
     print(f"Vector dimension: {vector_size}") # 768を確認
 
-    client.recreate_collection(
-        collection_name=COLLECTION_NAME,
-        vectors_config=models.VectorParams(
-            size=vector_size,
-            distance=models.Distance.COSINE
-        )
+    # 法令名・章・有効期間で絞り込めるように payload index も作成
+    collection = create_shadow_collection(client, COLLECTION_NAME, vector_size, PAYLOAD_INDEXES)
+
+    print(f"Uploading to Qdrant ({collection})...")
+    payloads = [chunk_payload(chunk) for chunk in chunks]
+    # ベクトルは memmap のまま渡し、バッチごとに読み出してもらう
+    client.upload_collection(
+        collection_name=collection,
+        vectors=embeddings,
+        payload=payloads,
+        ids=[record_point_id(p) for p in payloads],
+        batch_size=256,
+        wait=True,
     )
 
-    print("Uploading to Qdrant...")
-    points = []
-    for i, chunk in enumerate(chunks):
-        points.append(models.PointStruct(
-            id=i,
-            vector=embeddings[i].tolist(),
-            payload={
-                "law_name": chunk.get("law_name"),
-                "article_id": chunk.get("article_id"),
-                "caption": chunk.get("caption"),
-                "text": chunk.get("text")
-            }
-        ))
-
-    client.upload_points(collection_name=COLLECTION_NAME, points=points)
-    print(f"完了: {len(points)} 件を '{COLLECTION_NAME}' に登録しました。")
+    # 4. 検証してからエイリアスを切り替える（失敗したら稼働中のコレクションはそのまま）
+    probe = next(i for i, p in enumerate(payloads) if p.get("searchable"))
+    publish_collection(
+        client, COLLECTION_NAME, collection, len(payloads), np.asarray(embeddings[probe], dtype=np.float32)
+    )
 
 if __name__ == "__main__":
-    upsert_gemma()
+    import argparse
+
+    parser = argparse.ArgumentParser(description="法令チャンクをベクトル化して Qdrant に登録する")
+    parser.add_argument("--rollback", action="store_true", help="エイリアスを1つ前のバージョンに戻す")
+    args = parser.parse_args()
+
+    if args.rollback:
+        rollback(connect_qdrant(), COLLECTION_NAME)
+    else:
+        upsert_gemma()